@@ -7,12 +7,17 @@ ROOT_DIR = Path(__file__).resolve().parent.parent
 if str(ROOT_DIR) not in sys.path:
     sys.path.append(str(ROOT_DIR))
 
+from contextlib import contextmanager
 from datetime import date, timedelta, datetime
+import threading
+import time
 import altair as alt
 import pandas as pd
 import streamlit as st
 import snowflake.connector
 from common.snow import connect_snowflake
+from common.query_metrics import execute as timed_execute, record as record_query
+from common.swr import PENDING, STALE, SWRCache
 
 # --------------------------- Page / Config ---------------------------
 st.set_page_config(page_title="Flight Price Tracker", page_icon="✈️", layout="wide")
@@ -102,32 +107,146 @@ def get_connection():
 
     return snowflake.connector.connect(**kwargs)
 
-@st.cache_data(ttl=CACHE_TTL_SECS)
-def fetch_df(sql: str, params: dict | None = None) -> pd.DataFrame:
+_cache_probe = threading.local()  # set when the cached body actually runs (= cache miss)
+
+@st.cache_data(ttl=CACHE_TTL_SECS, show_spinner=False)  # also runs on prefetch threads
+def _fetch_df_cached(sql: str, params: dict | None = None, tag: str = "app.query") -> pd.DataFrame:
     """Cached reads (24h) to keep Snowflake usage low."""
+    _cache_probe.miss = True
     with connect_snowflake(
     schema=SNOW.get("schema", "MART")  # keep your selected schema
     ) as con:
         cur = con.cursor()
         try:
-            cur.execute(sql, params or {})
+            timed_execute(cur, sql, params, tag=tag, cache="miss")
             cols = [c[0] for c in cur.description]
             rows = cur.fetchall()
         finally:
             cur.close()
     return pd.DataFrame(rows, columns=cols)
 
+def fetch_df(sql: str, params: dict | None = None, tag: str = "app.query") -> pd.DataFrame:
+    """Cached read + query metrics (misses are timed in the cached body, hits here)."""
+    _cache_probe.miss = False
+    t0 = time.perf_counter()
+    df = _fetch_df_cached(sql, params, tag)
+    if not _cache_probe.miss:
+        record_query(tag, sql, (time.perf_counter() - t0) * 1000, row_count=len(df), cache="hit")
+    return df
+
+# --------------------------- Progressive loading ---------------------------
+# Sections read through a process-wide stale-while-revalidate cache: independent
+# queries are prefetched in parallel, and a section whose fresh result is not
+# back within SECTION_BUDGET_SECS shows the last known result while the refresh
+# finishes in the background (the page reruns once it lands). Only a first-ever
+# load with nothing cached waits on Snowflake, behind a per-section spinner.
+SECTION_BUDGET_SECS = 0.3      # wait this long for fresh data before showing stale
+REVALIDATE_MAX_SECS = 120      # stop waiting for background refreshes after this
+
+_page_t0 = time.perf_counter()
+_timings: list[dict] = []       # one row per rendered section (debug panel)
+_revalidating: list = []        # futures of refreshes behind stale sections
+
+@st.cache_resource
+def _swr() -> SWRCache:
+    return SWRCache(max_workers=4, fresh_secs=CACHE_TTL_SECS)
+
+def _swr_key(sql: str, params: dict | None, tag: str) -> tuple:
+    return (tag, sql, tuple(sorted((params or {}).items())))
+
+def prefetch(sql: str, params: dict | None, tag: str) -> None:
+    """Start a query in the background; a later load() of the same query picks it up."""
+    _swr().prefetch(_swr_key(sql, params, tag), fetch_df, sql, params, tag)
+
+@contextmanager
+def section(name: str):
+    """Time one page section (load + render) for the debug panel."""
+    info = {"section": name, "source": "-"}
+    t0 = time.perf_counter()
+    try:
+        yield info
+    finally:
+        t1 = time.perf_counter()
+        info["ms"] = round((t1 - t0) * 1000, 1)
+        info["done_at_ms"] = round((t1 - _page_t0) * 1000, 1)
+        _timings.append(info)
+
+def load(info: dict, sql: str, params: dict | None, tag: str) -> pd.DataFrame:
+    """
+    Read for one section: fresh if ready within budget, else stale, else wait.
+    The frame is shared across reruns and sessions: copy before mutating it.
+    """
+    res = _swr().get(_swr_key(sql, params, tag), fetch_df, sql, params, tag,
+                     budget_secs=SECTION_BUDGET_SECS)
+    info["source"] = res.status
+    if res.status == PENDING:
+        with st.spinner(f"Loading {info['section']} from Snowflake (the warehouse may be resuming)…"):
+            res = res.wait()
+        info["source"] = "waited"
+    elif res.status == STALE:
+        if res.error is not None:
+            st.caption(f"⚠️ Showing cached data — refresh failed: {res.error}")
+        else:
+            st.caption("🔄 Showing cached data while fresh data loads…")
+            _revalidating.append(res.pending)
+    return res.value
+
+def finish_page() -> None:
+    """Footer and debug timings, then wait for background refreshes and rerun with them."""
+    st.caption(FOOTER)
+    with st.sidebar.expander("⏱ Render timings (debug)"):
+        if _timings:
+            first = min(t["done_at_ms"] for t in _timings)
+            total = (time.perf_counter() - _page_t0) * 1000
+            st.caption(f"First content after {first:,.0f} ms · all sections after {total:,.0f} ms")
+            st.dataframe(pd.DataFrame(_timings), use_container_width=True, hide_index=True)
+
+    if not _revalidating:
+        return
+    status = st.empty()
+    deadline = time.monotonic() + REVALIDATE_MAX_SECS
+    while not all(f.done() for f in _revalidating) and time.monotonic() < deadline:
+        # writing an element each tick lets widget interactions interrupt the wait
+        status.caption("🔄 Refreshing from Snowflake…")
+        time.sleep(0.25)
+    status.empty()
+    if all(f.done() and f.exception() is None for f in _revalidating):
+        st.rerun()
+
 # --------------------------- SQL ---------------------------
+# Sidebar + overview read the small per-route rollups (dbt mart_route_rollup_*),
+# not the full mart. Week granularity: a route shows if any of its departure
+# weeks overlaps the window.
 ROUTES_SQL = """
 SELECT r.route_code
 FROM FLIGHT_DB.CORE.DIM_SUPPORTED_ROUTES r
-JOIN FLIGHT_DB.MART.MART_LOWEST_PRICE_BY_ROUTE_DATE m
-  ON m.route_code = r.route_code
-WHERE m.departure_date BETWEEN %(start)s AND %(end)s
+JOIN FLIGHT_DB.MART.MART_ROUTE_ROLLUP_WEEKLY w
+  ON w.route_code = r.route_code
+WHERE w.period_start <= %(end)s
+  AND DATEADD('day', 6, w.period_start) >= %(start)s
 GROUP BY r.route_code
 ORDER BY r.route_code
 """
 
+OVERVIEW_SQL = """
+SELECT
+  route_code,
+  period_start,
+  CAST(min_price_aud AS FLOAT)        AS min_price_aud,
+  CAST(median_price_aud AS FLOAT)     AS median_price_aud,
+  CAST(latest_min_price_aud AS FLOAT) AS latest_min_price_aud,
+  days_of_coverage,
+  last_quote_day
+FROM FLIGHT_DB.MART.{table}
+WHERE period_start <= %(end)s
+  AND period_start >= DATE_TRUNC('{grain}', %(start)s::DATE)
+ORDER BY route_code, period_start
+"""
+
+ROLLUP_TABLES = {"week": "MART_ROUTE_ROLLUP_WEEKLY", "month": "MART_ROUTE_ROLLUP_MONTHLY"}
+
+FOOTER = "Data source: Kiwi Tequila API → Snowflake (RAW/STG/CORE/MART) via dbt. UI: Streamlit + Altair."
+
 CHEAPEST_NEXT_SQL = """
 WITH latest AS (
   SELECT route_code, departure_date, MAX(quote_day) AS last_day
@@ -168,6 +287,7 @@ ORDER BY quote_day
 
 # --------------------------- Sidebar / Controls ---------------------------
 with st.sidebar:
+    view = st.radio("View", ["Route detail", "All routes overview"], index=0, horizontal=True)
     today = date.today()
     start_d = st.date_input("Start departure date", today)
     end_d = st.date_input("End departure date", today + timedelta(days=30))
@@ -179,7 +299,8 @@ with st.sidebar:
     if st.button("🔄 Reload today’s data (once every 5 min)"):
         if can_refresh_every():
             st.cache_data.clear()
-            st.success("Cache cleared ✅ — next load will pull fresh data from Snowflake.")
+            _swr().invalidate_all()
+            st.success("Cache cleared ✅ — current data stays on screen while fresh data loads from Snowflake.")
         else:
             st.info("⏳ Please wait a few minutes before refreshing again.")
 
@@ -188,101 +309,178 @@ with st.sidebar:
         "Queries are cached for 24 hours to control Snowflake costs."
     )
 
-# Load supported routes that actually have data in window
-routes_df = fetch_df(ROUTES_SQL, {"start": start_d, "end": end_d})
-routes = routes_df["ROUTE_CODE"].tolist()
+# --------------------------- Prefetch ---------------------------
+# Route detail: routes, cheapest fares and trend only depend on the controls and
+# on the previous selections, so start all three at once instead of top-to-bottom.
+window = {"start": start_d, "end": end_d}
+if view == "Route detail":
+    prefetch(ROUTES_SQL, window, "app.routes")
+    last_route = st.session_state.get("route")
+    if last_route:
+        prefetch(CHEAPEST_NEXT_SQL, {"route": last_route, **window}, "app.cheapest")
+        # trend_date belongs to the route it was picked for: skip it right after a route change
+        if (st.session_state.get("trend_date") is not None
+                and st.session_state.get("_trend_route") == last_route):
+            prefetch(TREND_SQL, {"route": last_route, "dep": st.session_state["trend_date"]}, "app.trend")
+
+# --------------------------- All routes overview ---------------------------
+if view == "All routes overview":
+    grain = st.radio("Group departures by", ["week", "month"], index=0, horizontal=True)
+
+    st.subheader(f"All routes — latest cheapest fare per departure {grain}")
+    with section("overview") as sec:
+        ov = load(sec, OVERVIEW_SQL.format(table=ROLLUP_TABLES[grain], grain=grain),
+                  window, tag=f"app.overview_{grain}").copy()
+        if ov.empty:
+            st.info("No rollup data in the selected window. Run dbt to build the route rollups.")
+        else:
+            ov["PERIOD_START"] = pd.to_datetime(ov["PERIOD_START"]).dt.date
+            best = ov.loc[ov["LATEST_MIN_PRICE_AUD"].idxmin()]
+            k1, k2, k3 = st.columns([1, 1, 2])
+            k1.metric("Cheapest now", f"AUD {best['LATEST_MIN_PRICE_AUD']:,.0f}")
+            k2.metric("Routes", f"{ov['ROUTE_CODE'].nunique()}")
+            k3.caption(f"**{best['ROUTE_CODE']}**, {grain} of {best['PERIOD_START']} · "
+                       f"**Last quote day:** {pd.to_datetime(ov['LAST_QUOTE_DAY']).max().date()}")
+
+            heat = (
+                alt.Chart(ov)
+                .mark_rect()
+                .encode(
+                    x=alt.X("PERIOD_START:O", title=f"Departure {grain}",
+                            axis=alt.Axis(labelAngle=-45)),
+                    y=alt.Y("ROUTE_CODE:N", title="Route"),
+                    color=alt.Color("LATEST_MIN_PRICE_AUD:Q", title="Latest min (AUD)",
+                                    scale=alt.Scale(scheme="redyellowgreen", reverse=True)),
+                    tooltip=[
+                        alt.Tooltip("ROUTE_CODE:N", title="Route"),
+                        alt.Tooltip("PERIOD_START:O", title=f"{grain.title()} of"),
+                        alt.Tooltip("LATEST_MIN_PRICE_AUD:Q", title="Latest min (AUD)", format="$.0f"),
+                        alt.Tooltip("MIN_PRICE_AUD:Q", title="All-time min (AUD)", format="$.0f"),
+                        alt.Tooltip("MEDIAN_PRICE_AUD:Q", title="Median (AUD)", format="$.0f"),
+                        alt.Tooltip("DAYS_OF_COVERAGE:Q", title="Departure days covered"),
+                    ],
+                )
+                .properties(height=max(160, 32 * ov["ROUTE_CODE"].nunique()))
+            )
+            st.altair_chart(heat, use_container_width=True)
+
+            summary = (
+                ov.groupby("ROUTE_CODE", as_index=False)
+                .agg(latest=("LATEST_MIN_PRICE_AUD", "min"),
+                     low=("MIN_PRICE_AUD", "min"),
+                     median=("MEDIAN_PRICE_AUD", "median"))
+                .rename(columns={"ROUTE_CODE": "Route", "latest": "Latest min (AUD)",
+                                 "low": "All-time min (AUD)", "median": "Median (AUD)"})
+                .sort_values("Latest min (AUD)")
+            )
+            for col in ["Latest min (AUD)", "All-time min (AUD)", "Median (AUD)"]:
+                summary[col] = summary[col].map(lambda x: f"AUD {x:,.0f}")
+            st.dataframe(summary, use_container_width=True, hide_index=True)
 
-if not routes:
-    st.warning(
-        "No supported routes have data for this date range. "
-        "Run ingestion for these dates or widen the range."
-    )
+    finish_page()
     st.stop()
 
-route = st.sidebar.selectbox("Route", routes, index=0)
+# Load supported routes that actually have data in window
+with section("routes") as sec:
+    routes_df = load(sec, ROUTES_SQL, window, tag="app.routes")
+    routes = routes_df["ROUTE_CODE"].tolist()
+
+    if not routes:
+        st.warning(
+            "No supported routes have data for this date range. "
+            "Run ingestion for these dates or widen the range."
+        )
+        st.stop()
+
+    route = st.sidebar.selectbox("Route", routes, index=0, key="route")
 
 # --------------------------- Query + Present ---------------------------
-params = {"route": route, "start": start_d, "end": end_d}
-raw = fetch_df(CHEAPEST_NEXT_SQL, params)
+with section("cheapest") as sec:
+    st.subheader(f"Cheapest fares for {route} (latest quotes)")
+    params = {"route": route, **window}
+    raw = load(sec, CHEAPEST_NEXT_SQL, params, tag="app.cheapest")
+
+    df = raw.copy()
+    if not df.empty:
+        df["PRICE_AUD"] = pd.to_numeric(df["PRICE_AUD"], errors="coerce")
+        df["AIRLINE"] = df["AIRLINE_CODE"].map(AIRLINE_NAME).fillna(df["AIRLINE_CODE"])
+
+    if df.empty:
+        st.info("No fares in the selected window.")
+    else:
+        # KPIs (smaller captions for range & freshness)
+        k1, k2, k3, k4 = st.columns([1, 1, 1.5, 2])
+        min_price = float(df["PRICE_AUD"].min())
+        k1.metric("Lowest price", f"AUD {min_price:,.0f}")
+        k2.metric("Rows", f"{len(df)}")
+        k3.caption(f"**Date range:** {start_d} → {end_d}")
+        k4.caption(f"**Quote day:** {df['QUOTE_DAY'].max()}")
+
+        # User-facing summary table
+        df_disp = (
+            df[["ROUTE_CODE", "DEPARTURE_DATE", "PRICE_AUD", "AIRLINE", "STOPS"]]
+            .rename(columns={
+                "ROUTE_CODE": "Route",
+                "DEPARTURE_DATE": "Departure date",
+                "PRICE_AUD": "Price (AUD)",
+                "AIRLINE": "Airline",
+                "STOPS": "Stops",
+            })
+            .copy()
+        )
+        df_disp["Price (AUD)"] = df_disp["Price (AUD)"].map(lambda x: f"AUD {x:,.0f}")
+        st.dataframe(df_disp, use_container_width=True, hide_index=True)
 
-df = raw.copy()
+# --------------------------- Trend section ---------------------------
 if not df.empty:
-    df["PRICE_AUD"] = pd.to_numeric(df["PRICE_AUD"], errors="coerce")
-    df["AIRLINE"] = df["AIRLINE_CODE"].map(AIRLINE_NAME).fillna(df["AIRLINE_CODE"])
-
-st.subheader(f"Cheapest fares for {route} (latest quotes)")
-if df.empty:
-    st.info("No fares in the selected window.")
-else:
-    # KPIs (smaller captions for range & freshness)
-    k1, k2, k3, k4 = st.columns([1, 1, 1.5, 2])
-    min_price = float(df["PRICE_AUD"].min())
-    k1.metric("Lowest price", f"AUD {min_price:,.0f}")
-    k2.metric("Rows", f"{len(df)}")
-    k3.caption(f"**Date range:** {start_d} → {end_d}")
-    k4.caption(f"**Quote day:** {df['QUOTE_DAY'].max()}")
-
-    # User-facing summary table
-    df_disp = (
-        df[["ROUTE_CODE", "DEPARTURE_DATE", "PRICE_AUD", "AIRLINE", "STOPS"]]
-        .rename(columns={
-            "ROUTE_CODE": "Route",
-            "DEPARTURE_DATE": "Departure date",
-            "PRICE_AUD": "Price (AUD)",
-            "AIRLINE": "Airline",
-            "STOPS": "Stops",
-        })
-        .copy()
-    )
-    df_disp["Price (AUD)"] = df_disp["Price (AUD)"].map(lambda x: f"AUD {x:,.0f}")
-    st.dataframe(df_disp, use_container_width=True, hide_index=True)
-
-    # --------------------------- Trend section ---------------------------
-    st.markdown("### Price trend for a specific departure date (over quote days)")
-    pick_date = st.selectbox(
-        "Choose a departure date to view its price history:",
-        sorted(df["DEPARTURE_DATE"].unique()),
-        index=0,
-        key="trend_date",
-    )
+    with section("trend") as sec:
+        st.markdown("### Price trend for a specific departure date (over quote days)")
+        pick_date = st.selectbox(
+            "Choose a departure date to view its price history:",
+            sorted(df["DEPARTURE_DATE"].unique()),
+            index=0,
+            key="trend_date",
+        )
 
-    trend = fetch_df(TREND_SQL, {"route": route, "dep": pick_date})
-    if not trend.empty:
-        trend["PRICE_AUD"] = pd.to_numeric(trend["PRICE_AUD"], errors="coerce")
-        # Visual outlier guard
-        trend = trend[(trend["PRICE_AUD"] >= MIN_PRICE) & (trend["PRICE_AUD"] <= MAX_PRICE)]
-
-        tdisp = trend.rename(columns={
-            "QUOTE_DAY": "Quote day",
-            "PRICE_AUD": "Price_AUD",
-            "AIRLINE_CODE": "Airline_Code",
-            "STOPS": "Stops",
-        })
-        tdisp["Airline"] = tdisp["Airline_Code"].map(AIRLINE_NAME).fillna(tdisp["Airline_Code"])
-
-        # Force date-only on X axis & format dd/mm/yy
-        tdisp["Quote day"] = pd.to_datetime(tdisp["Quote day"]).dt.date
-
-        chart = (
-            alt.Chart(tdisp)
-            .mark_line(point=True)
-            .encode(
-                x=alt.X("Quote day:T", title="Quote day",
-                        axis=alt.Axis(format="%d/%m/%y", labelAngle=0)),
-                y=alt.Y("Price_AUD:Q", title="Price (AUD)",
-                        scale=alt.Scale(zero=False),
-                        axis=alt.Axis(format="$.0f")),
-                tooltip=[
-                    alt.Tooltip("Quote day:T", title="Quote day", format="%d/%m/%y"),
-                    alt.Tooltip("Price_AUD:Q", title="Price (AUD)", format="$.0f"),
-                    alt.Tooltip("Airline:N", title="Airline"),
-                    alt.Tooltip("Stops:Q", title="Stops"),
-                ],
+        trend = load(sec, TREND_SQL, {"route": route, "dep": pick_date}, tag="app.trend")
+        st.session_state["_trend_route"] = route
+        if not trend.empty:
+            trend = trend.copy()
+            trend["PRICE_AUD"] = pd.to_numeric(trend["PRICE_AUD"], errors="coerce")
+            # Visual outlier guard
+            trend = trend[(trend["PRICE_AUD"] >= MIN_PRICE) & (trend["PRICE_AUD"] <= MAX_PRICE)]
+
+            tdisp = trend.rename(columns={
+                "QUOTE_DAY": "Quote day",
+                "PRICE_AUD": "Price_AUD",
+                "AIRLINE_CODE": "Airline_Code",
+                "STOPS": "Stops",
+            })
+            tdisp["Airline"] = tdisp["Airline_Code"].map(AIRLINE_NAME).fillna(tdisp["Airline_Code"])
+
+            # Force date-only on X axis & format dd/mm/yy
+            tdisp["Quote day"] = pd.to_datetime(tdisp["Quote day"]).dt.date
+
+            chart = (
+                alt.Chart(tdisp)
+                .mark_line(point=True)
+                .encode(
+                    x=alt.X("Quote day:T", title="Quote day",
+                            axis=alt.Axis(format="%d/%m/%y", labelAngle=0)),
+                    y=alt.Y("Price_AUD:Q", title="Price (AUD)",
+                            scale=alt.Scale(zero=False),
+                            axis=alt.Axis(format="$.0f")),
+                    tooltip=[
+                        alt.Tooltip("Quote day:T", title="Quote day", format="%d/%m/%y"),
+                        alt.Tooltip("Price_AUD:Q", title="Price (AUD)", format="$.0f"),
+                        alt.Tooltip("Airline:N", title="Airline"),
+                        alt.Tooltip("Stops:Q", title="Stops"),
+                    ],
+                )
+                .properties(height=320)
             )
-            .properties(height=320)
-        )
-        st.altair_chart(chart, use_container_width=True)
-    else:
-        st.info("No trend data for that date yet. Run ingestion on multiple days to build history.")
+            st.altair_chart(chart, use_container_width=True)
+        else:
+            st.info("No trend data for that date yet. Run ingestion on multiple days to build history.")
 
-st.caption("Data source: Kiwi Tequila API → Snowflake (RAW/STG/CORE/MART) via dbt. UI: Streamlit + Altair.")
\ No newline at end of file
+finish_page()
@@ -0,0 +1,85 @@
+# bench/import_time.py
+"""
+Import-time benchmark for the CLI and flow entry points.
+
+Each module is imported in a fresh interpreter (so nothing is warm) and we
+report min/median wall time plus any heavy modules that got pulled in.
+Importing an entry point must not connect to Snowflake or load the connector.
+
+Usage:
+  python bench/import_time.py                     # default entry points, 7 runs each
+  python bench/import_time.py --runs 15 ingestion.main
+  python bench/import_time.py --max-ms 300        # non-zero exit if any median is slower
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+ENTRY_POINTS = [
+    "ingestion.main",           # CLI: python -m ingestion.main
+    "ingestion.backfill",       # CLI: python -m ingestion.backfill
+    "orchestration.prefect_flow",
+]
+
+# Modules that should only load when a run actually needs them
+HEAVY_MODULES = ["snowflake.connector", "cryptography", "streamlit", "pandas", "pyarrow", "dotenv"]
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"secs": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def measure(module: str, runs: int) -> dict:
+    samples, loaded = [], []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if out.returncode != 0:
+            return {"module": module, "error": out.stderr.strip().splitlines()[-1]}
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(result["secs"] * 1000)
+        loaded = result["loaded"]
+    return {
+        "module": module,
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "heavy_loaded": loaded,
+    }
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("modules", nargs="*", default=ENTRY_POINTS)
+    ap.add_argument("--runs", type=int, default=7)
+    ap.add_argument("--max-ms", type=float, help="fail if any median import time exceeds this")
+    args = ap.parse_args(argv)
+
+    failed = False
+    print(f"{'module':<32} {'min ms':>8} {'median ms':>10}  heavy modules loaded")
+    for module in args.modules:
+        r = measure(module, args.runs)
+        if "error" in r:
+            print(f"{module:<32} ERROR {r['error']}")
+            failed = True
+            continue
+        print(f"{module:<32} {r['min_ms']:>8.1f} {r['median_ms']:>10.1f}  {', '.join(r['heavy_loaded']) or '-'}")
+        if args.max_ms is not None and r["median_ms"] > args.max_ms:
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# common/circuit_breaker.py
+"""
+In-process circuit breakers, one per dependency (snowflake, tequila, ...).
+
+States:
+  closed     calls flow; outcomes go into a sliding time window. When the
+             window holds >= min_calls and the failure rate reaches
+             failure_rate, the breaker opens.
+  open       calls are shed immediately with CircuitOpenError (carrying
+             retry_after) until open_secs have passed.
+  half_open  up to half_open_max_calls probe calls are let through; a probe
+             success closes the breaker, a probe failure re-opens it with a
+             doubled cool-down (capped at max_open_secs).
+
+Callers reserve a call with before_call() and must end it with exactly one of
+record_success(), record_failure(), trip() or release() on every exit path. A
+probe that is never returned (killed thread, BaseException) is reclaimed after
+probe_timeout_secs, so the breaker cannot stay half_open forever.
+
+Breakers come from a process-wide registry (get_breaker), so concurrent Prefect
+tasks / worker threads share one view of each dependency and stop hammering it
+together. State changes are guarded by a threading.Lock that is never held
+across a call.
+
+The file-based breaker in orchestration/prefect_flow.py stays: it persists an
+auth lockout across runs, this one sheds load within a run.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+    def __init__(self, name: str, retry_after: float, reason: str = "", auth: bool = False):
+        self.name = name
+        self.retry_after = max(0.0, retry_after)
+        self.reason = reason
+        self.auth = auth  # opened by an auth failure: waiting it out will not help
+        super().__init__(
+            f"circuit '{name}' is open, retry in {self.retry_after:.0f}s"
+            + (f" (last failure: {reason})" if reason else "")
+        )
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        window_secs: float = 60.0,
+        min_calls: int = 5,
+        open_secs: float = 30.0,
+        max_open_secs: float = 600.0,
+        half_open_max_calls: int = 1,
+        probe_timeout_secs: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.window_secs = window_secs
+        self.min_calls = min_calls
+        self.open_secs = open_secs
+        self.max_open_secs = max_open_secs
+        self.half_open_max_calls = half_open_max_calls
+        self.probe_timeout_secs = probe_timeout_secs
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._window: deque = deque()  # (timestamp, ok)
+        self._opened_at = 0.0
+        self._cooldown = open_secs
+        self._probes = 0
+        self._probe_at = 0.0  # when the latest half-open probe was reserved
+        self._reason = ""
+        self._auth = False
+
+    # ----------------------------- state -----------------------------
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self._cooldown:
+            self._state, self._probes = HALF_OPEN, 0
+        if (self._state == HALF_OPEN and self._probes
+                and self._clock() - self._probe_at >= self.probe_timeout_secs):
+            print(f"[circuit] {self.name} probe not returned after {self.probe_timeout_secs:.0f}s; reclaimed")
+            self._probes = 0
+        return self._state
+
+    def _open(self, reason: str, cooldown: float, auth: bool = False) -> None:
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._cooldown = min(cooldown, self.max_open_secs)
+        self._reason = reason
+        self._auth = auth
+        self._window.clear()
+        print(f"[circuit] {self.name} OPEN for {self._cooldown:.0f}s: {reason}")
+
+    def _retry_after(self) -> float:
+        return self._cooldown - (self._clock() - self._opened_at)
+
+    # ----------------------------- protocol -----------------------------
+    def before_call(self) -> None:
+        """Reserve permission for one call or raise CircuitOpenError."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                self._probe_at = self._clock()
+                return
+            retry_after = self._retry_after() if state == OPEN else 1.0
+            raise CircuitOpenError(self.name, retry_after, self._reason, auth=self._auth)
+
+    def raise_if_open(self) -> None:
+        """Pre-flight check: raise while open, without reserving a half-open probe."""
+        with self._lock:
+            if self._current_state() == OPEN:
+                raise CircuitOpenError(self.name, self._retry_after(), self._reason, auth=self._auth)
+
+    def release(self) -> None:
+        """End a reserved call without an outcome (it said nothing about the dependency)."""
+        with self._lock:
+            if self._current_state() == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state == HALF_OPEN:
+                print(f"[circuit] {self.name} closed (probe succeeded)")
+                self._state, self._cooldown, self._probes = CLOSED, self.open_secs, 0
+                self._window.clear()
+                return
+            self._push(True)
+
+    def record_failure(self, reason: str = "") -> None:
+        with self._lock:
+            state = self._current_state()
+            if state == HALF_OPEN:
+                self._open(reason or "probe failed", self._cooldown * 2)
+                return
+            if state == OPEN:
+                return
+            self._push(False)
+            calls = len(self._window)
+            failures = sum(1 for _, ok in self._window if not ok)
+            if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                self._open(reason or f"{failures}/{calls} calls failed", self.open_secs)
+
+    def trip(self, reason: str, open_secs: Optional[float] = None, auth: bool = False) -> None:
+        """
+        Open now, regardless of the window (e.g. auth errors: never retry in parallel).
+        auth=True marks the CircuitOpenErrors it raises, so callers stop instead of waiting.
+        """
+        with self._lock:
+            self._open(reason, open_secs if open_secs is not None else self.open_secs, auth=auth)
+
+    def _push(self, ok: bool) -> None:
+        now = self._clock()
+        self._window.append((now, ok))
+        while self._window and now - self._window[0][0] > self.window_secs:
+            self._window.popleft()
+
+
+# ----------------------------- registry -----------------------------
+# Defaults per dependency; anything else gets CircuitBreaker defaults.
+BREAKER_DEFAULTS: Dict[str, dict] = {
+    # one call = one fetch_min_price (itself up to 3 HTTP attempts)
+    "tequila": dict(failure_rate=0.5, window_secs=60, min_calls=10, open_secs=30, probe_timeout_secs=120),
+    # one call = one connect; few calls per run, so trip early
+    "snowflake": dict(failure_rate=0.5, window_secs=120, min_calls=3, open_secs=60, probe_timeout_secs=180),
+}
+
+_registry: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name: str, **overrides) -> CircuitBreaker:
+    """Process-wide breaker for `name` (created on first use)."""
+    with _registry_lock:
+        breaker = _registry.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, **{**BREAKER_DEFAULTS.get(name, {}), **overrides})
+            _registry[name] = breaker
+        return breaker
@@ -0,0 +1,266 @@
+# common/lake.py
+"""
+Local Parquet copy of MART_LOWEST_PRICE_BY_ROUTE_DATE for credit-free reads.
+
+Layout (Hive partitions, pruned by the reader):
+  $LAKE_DIR/route_code=MEL-BKK/quote_month=2025-10/part-0.parquet
+  $LAKE_DIR/_watermark.json          last exported quote_day
+
+Each export rewrites every quote_month from the watermark's month onwards, one
+file per route x month. Late rows for an already exported day (Prefect retry,
+second run, late sharded worker) and prices that changed for it are therefore
+picked up, and the file count stays at routes x months. Earlier months are
+closed and never touched again. Rows are sorted by departure_date inside every
+file and row groups are kept small, so the min/max statistics let date-range
+predicates skip row groups. Columns are lower-case; quote_day and
+departure_date are DATEs.
+
+pyarrow is optional for the rest of the project and only imported here.
+
+Usage:
+  python -m common.lake export            # incremental (daily flow runs this after dbt)
+  python -m common.lake export --full     # rebuild the whole dataset
+  python -m common.lake query --route MEL-BKK --dep-from 2025-11-01 --dep-to 2025-11-30
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+from datetime import date
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+from common.query_metrics import execute as timed_execute
+
+LAKE_DIR = os.environ.get("LAKE_DIR", "data/lake/mart_lowest_price_by_route_date")
+PARTITION_COLS = ["route_code", "quote_month"]
+ROW_GROUP_ROWS = 1_024  # ~ a month of quotes for ~5 weeks of departures -> useful min/max stats
+
+EXPORT_SQL = """
+SELECT
+  route_code,
+  TO_CHAR(quote_day, 'YYYY-MM')             AS quote_month,
+  origin,
+  destination,
+  departure_date,
+  quote_day::DATE                           AS quote_day,
+  CAST(daily_min_price_aud AS FLOAT)        AS daily_min_price_aud,
+  stops,
+  airline_code,
+  source,
+  cabin,
+  observed_at,
+  is_carried_forward
+FROM FLIGHT_DB.MART.MART_LOWEST_PRICE_BY_ROUTE_DATE
+WHERE quote_day::DATE >= %(month_start)s
+ORDER BY route_code, quote_month, departure_date, quote_day
+"""
+
+
+def _pa():
+    try:
+        import pyarrow as pa
+        import pyarrow.compute  # noqa: F401  (pa.compute)
+        import pyarrow.dataset as ds
+        import pyarrow.fs as pafs
+    except ImportError as e:
+        raise RuntimeError("The Parquet lake needs pyarrow: pip install pyarrow") from e
+    return pa, ds, pafs
+
+
+def _partitioning(pa, ds):
+    # explicit string types: stop '2025-10' or route codes being inferred as anything else
+    return ds.partitioning(pa.schema([(c, pa.string()) for c in PARTITION_COLS]), flavor="hive")
+
+
+# ----------------------------- Watermark -----------------------------
+def _watermark_path(lake_dir: str) -> Path:
+    return Path(lake_dir) / "_watermark.json"
+
+def read_watermark(lake_dir: str = LAKE_DIR) -> Optional[date]:
+    try:
+        return date.fromisoformat(json.loads(_watermark_path(lake_dir).read_text())["last_quote_day"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _write_watermark(lake_dir: str, last_quote_day: date) -> None:
+    path = _watermark_path(lake_dir)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"last_quote_day": last_quote_day.isoformat()}))
+    os.replace(tmp, path)
+
+
+# ----------------------------- Export -----------------------------
+def export_mart(lake_dir: str = LAKE_DIR, full: bool = False, con=None) -> int:
+    """
+    Rewrite the open quote months (the watermark's month onwards). Returns rows written.
+    The new files are staged under _staging/ (ignored by readers) and swapped in
+    per month; the watermark only moves after the swap, so a failed export is
+    simply redone by the retry.
+    """
+    pa, ds, _ = _pa()
+
+    if full and Path(lake_dir).exists():
+        shutil.rmtree(lake_dir)
+    Path(lake_dir).mkdir(parents=True, exist_ok=True)
+
+    since = read_watermark(lake_dir)
+    month_start = since.replace(day=1) if since else date(1900, 1, 1)
+    staging = Path(lake_dir) / "_staging"
+    if staging.exists():
+        shutil.rmtree(staging)
+
+    def _export(c) -> int:
+        stats = {"rows": 0, "last_day": None}
+        cur = c.cursor()
+        try:
+            timed_execute(cur, EXPORT_SQL, {"month_start": month_start}, tag="lake.export")
+            batches = iter(cur.fetch_arrow_batches())
+            first = next((b for b in batches if b.num_rows), None)
+            if first is None:
+                return 0
+            schema = first.rename_columns([n.lower() for n in first.column_names]).schema
+
+            def _batches():
+                for batch in (first, *batches):
+                    if batch.num_rows == 0:
+                        continue
+                    batch = batch.rename_columns([n.lower() for n in batch.column_names]).cast(schema)
+                    stats["rows"] += batch.num_rows
+                    batch_max = pa.compute.max(batch.column("quote_day")).as_py()
+                    stats["last_day"] = max(stats["last_day"], batch_max) if stats["last_day"] else batch_max
+                    # the connector yields pyarrow Tables
+                    yield from (batch.to_batches() if isinstance(batch, pa.Table) else [batch])
+
+            # one write for the whole result: one file per route x month, full-size row groups
+            ds.write_dataset(
+                pa.RecordBatchReader.from_batches(schema, _batches()),
+                str(staging),
+                format="parquet",
+                partitioning=_partitioning(pa, ds),
+                basename_template="part-{i}.parquet",
+                file_options=ds.ParquetFileFormat().make_write_options(compression="zstd", write_statistics=True),
+                max_rows_per_group=ROW_GROUP_ROWS,
+                min_rows_per_group=ROW_GROUP_ROWS,
+                preserve_order=True,  # keep EXPORT_SQL's sort, so row-group stats stay tight
+            )
+        finally:
+            cur.close()
+
+        _swap_in(lake_dir, staging)
+        _write_watermark(lake_dir, stats["last_day"])
+        return stats["rows"]
+
+    if con is not None:
+        return _export(con)
+    from common.snow import connect_snowflake
+    with connect_snowflake() as c:
+        return _export(c)
+
+
+def _swap_in(lake_dir: str, staging: Path) -> None:
+    """Replace every quote_month present in staging (all routes) with the staged files."""
+    months = {p.name for p in staging.glob("route_code=*/quote_month=*")}
+    for month in months:
+        for old in Path(lake_dir).glob(f"route_code=*/{month}"):
+            shutil.rmtree(old)
+    for part in staging.glob("route_code=*/quote_month=*"):
+        target = Path(lake_dir) / part.parent.name / part.name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(part, target)
+    shutil.rmtree(staging)
+
+
+# ----------------------------- Reader -----------------------------
+def read_mart(
+    routes: Optional[Sequence[str]] = None,
+    quote_from: Optional[date] = None,
+    quote_to: Optional[date] = None,
+    dep_from: Optional[date] = None,
+    dep_to: Optional[date] = None,
+    columns: Optional[List[str]] = None,
+    lake_dir: str = LAKE_DIR,
+):
+    """
+    Filtered read as a pandas DataFrame. Route and quote-day bounds prune whole
+    partitions (route_code / quote_month directories); departure and quote-day
+    bounds then skip row groups via Parquet statistics. Files are memory-mapped.
+    """
+    pa, ds, pafs = _pa()
+
+    dataset = ds.dataset(
+        lake_dir,
+        format="parquet",
+        partitioning=_partitioning(pa, ds),
+        filesystem=pafs.LocalFileSystem(use_mmap=True),  # _watermark.json is skipped (leading "_")
+    )
+
+    f = ds.field
+    conds = []
+    if routes:
+        conds.append(f("route_code").isin([r.upper() for r in routes]))
+    if quote_from:
+        conds.append(f("quote_month") >= quote_from.strftime("%Y-%m"))
+        conds.append(f("quote_day") >= pa.scalar(quote_from, pa.date32()))
+    if quote_to:
+        conds.append(f("quote_month") <= quote_to.strftime("%Y-%m"))
+        conds.append(f("quote_day") <= pa.scalar(quote_to, pa.date32()))
+    if dep_from:
+        conds.append(f("departure_date") >= pa.scalar(dep_from, pa.date32()))
+    if dep_to:
+        conds.append(f("departure_date") <= pa.scalar(dep_to, pa.date32()))
+
+    expr = None
+    for c in conds:
+        expr = c if expr is None else expr & c
+    return dataset.to_table(columns=columns, filter=expr).to_pandas()
+
+
+def cheapest_latest(route: str, dep_from: date, dep_to: date, lake_dir: str = LAKE_DIR):
+    """Local equivalent of the app's CHEAPEST_NEXT_SQL: latest quote per departure, cheapest first."""
+    df = read_mart([route], dep_from=dep_from, dep_to=dep_to, lake_dir=lake_dir)
+    if df.empty:
+        return df
+    latest = df.sort_values("quote_day").groupby("departure_date", as_index=False).tail(1)
+    return latest.sort_values("daily_min_price_aud").reset_index(drop=True)
+
+
+def price_trend(route: str, departure_date: date, lake_dir: str = LAKE_DIR):
+    """Local equivalent of the app's TREND_SQL: one departure's price over quote days."""
+    df = read_mart([route], dep_from=departure_date, dep_to=departure_date, lake_dir=lake_dir)
+    return df.sort_values("quote_day").reset_index(drop=True)
+
+
+# ----------------------------- CLI -----------------------------
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Local Parquet lake of the price mart.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    exp = sub.add_parser("export")
+    exp.add_argument("--full", action="store_true", help="drop and rebuild the dataset")
+    q = sub.add_parser("query")
+    q.add_argument("--route", action="append", help="route code (repeatable)")
+    q.add_argument("--dep-from", type=date.fromisoformat)
+    q.add_argument("--dep-to", type=date.fromisoformat)
+    q.add_argument("--quote-from", type=date.fromisoformat)
+    q.add_argument("--quote-to", type=date.fromisoformat)
+    for p in (exp, q):
+        p.add_argument("--lake-dir", default=LAKE_DIR)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "export":
+        from dotenv import load_dotenv
+        load_dotenv()
+        n = export_mart(args.lake_dir, full=args.full)
+        print(f"[lake] exported {n} rows to {args.lake_dir} (watermark={read_watermark(args.lake_dir)})")
+        return 0
+
+    df = read_mart(args.route, args.quote_from, args.quote_to, args.dep_from, args.dep_to, lake_dir=args.lake_dir)
+    print(df.to_string(index=False, max_rows=50))
+    print(f"[lake] {len(df)} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
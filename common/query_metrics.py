@@ -0,0 +1,301 @@
+# common/query_metrics.py
+"""
+Query instrumentation for Snowflake cursors + a small cost report.
+
+Wrap cursor calls with `execute(cur, sql, params, tag="ingest.insert_quotes")`:
+each query's Snowflake query id, latency, row count and cache outcome is
+appended to a local SQLite metrics store (QUERY_METRICS_PATH, default
+.query_metrics.sqlite). Recording never raises: metrics must not break a run.
+
+Report (per query template and per run; --snowflake adds bytes scanned, server
+time, warehouse-cache share and result-cache hits from ACCOUNT_USAGE.QUERY_HISTORY
+and credits from WAREHOUSE_METERING_HISTORY):
+  python -m common.query_metrics report --days 7
+  python -m common.query_metrics report --days 7 --snowflake
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import statistics
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+# QUERY_HISTORY signature of a query answered from Snowflake's result cache
+RESULT_CACHE_MAX_EXEC_MS = 50
+
+_lock = threading.Lock()
+_con: Optional[sqlite3.Connection] = None
+_con_path: Optional[str] = None
+_default_run_id: Optional[str] = None
+
+
+# Settings are read on use, not at import: .env is loaded after this module is imported.
+def _metrics_path() -> str:
+    return os.environ.get("QUERY_METRICS_PATH", ".query_metrics.sqlite")
+
+
+def _run_id() -> str:
+    """QUERY_METRICS_RUN_ID if set (the Prefect flows pin their flow run id), else one id per process."""
+    global _default_run_id
+    pinned = os.environ.get("QUERY_METRICS_RUN_ID")
+    if pinned:
+        return pinned
+    if _default_run_id is None:
+        _default_run_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{os.getpid()}"
+    return _default_run_id
+
+
+def _store() -> sqlite3.Connection:
+    global _con, _con_path
+    path = _metrics_path()
+    if _con is not None and _con_path != path:
+        _con.close()
+        _con = None
+    if _con is None:
+        _con = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        _con_path = path
+        _con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS query_metrics (
+                ts          REAL,     -- epoch seconds at query start
+                run_id      TEXT,
+                tag         TEXT,     -- caller label, e.g. app.cheapest, ingest.insert_quotes
+                template_id TEXT,     -- hash of the whitespace-normalised SQL text
+                query_id    TEXT,     -- Snowflake query id (NULL on local cache hits)
+                elapsed_ms  REAL,
+                row_count   INTEGER,
+                cache       TEXT,     -- hit | miss | none
+                error       TEXT,
+                sql_text    TEXT
+            )
+            """
+        )
+        _con.commit()
+    return _con
+
+
+def set_run_id(run_id: str) -> None:
+    """Pin the run id for this process and any subprocess it starts."""
+    os.environ["QUERY_METRICS_RUN_ID"] = str(run_id)
+
+
+def normalize_sql(sql: str) -> str:
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def template_id(sql: str) -> str:
+    return hashlib.sha1(normalize_sql(sql).encode()).hexdigest()[:12]
+
+
+def record(
+    tag: str,
+    sql: str,
+    elapsed_ms: float,
+    row_count: Optional[int] = None,
+    query_id: Optional[str] = None,
+    cache: str = "none",
+    error: Optional[str] = None,
+    started: Optional[float] = None,
+) -> None:
+    try:
+        with _lock:
+            con = _store()
+            con.execute(
+                "INSERT INTO query_metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    started or time.time(), _run_id(), tag, template_id(sql), query_id,
+                    round(elapsed_ms, 2), row_count, cache, error, normalize_sql(sql)[:2000],
+                ),
+            )
+            con.commit()
+    except Exception as e:  # metrics are best-effort
+        print(f"[query_metrics] WARN could not record metric: {e}")
+
+
+def execute(cur, sql: str, params=None, *, tag: str = "query", many: bool = False, cache: str = "none"):
+    """cur.execute / cur.executemany with timing; returns the cursor like execute() does."""
+    started = time.time()
+    t0 = time.perf_counter()
+    error = None
+    try:
+        if many:
+            cur.executemany(sql, params or [])
+        else:
+            cur.execute(sql, params or {})
+        return cur
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record(
+            tag,
+            sql,
+            (time.perf_counter() - t0) * 1000,
+            row_count=getattr(cur, "rowcount", None),
+            query_id=getattr(cur, "sfqid", None),
+            cache=cache,
+            error=error,
+            started=started,
+        )
+
+
+# ----------------------------- Report -----------------------------
+def _pct(values, q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _fetch_snowflake_costs(query_ids, since: datetime):
+    """bytes/rows per query id and hourly credits for the period (ACCOUNT_USAGE lags up to ~45 min)."""
+    from common.snow import connect_snowflake
+
+    by_query, credits = {}, []
+    ids = list(query_ids)
+    with connect_snowflake() as con:
+        cur = con.cursor()
+        try:
+            for i in range(0, len(ids), 1000):
+                cur.execute(
+                    """
+                    SELECT query_id, bytes_scanned, rows_produced, total_elapsed_time,
+                           execution_time, percentage_scanned_from_cache, query_type, warehouse_name
+                    FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+                    WHERE start_time >= %(since)s AND query_id IN (%(ids)s)
+                    """,
+                    {"since": since, "ids": ids[i:i + 1000]},
+                )
+                for qid, bytes_scanned, rows, total_ms, exec_ms, pct_cache, qtype, wh in cur.fetchall():
+                    by_query[qid] = {
+                        "bytes": int(bytes_scanned or 0), "rows": int(rows or 0),
+                        "server_ms": float(total_ms or 0), "pct_cache": float(pct_cache or 0), "warehouse": wh,
+                        # reused result: nothing scanned, (almost) no execution
+                        "result_cache": qtype == "SELECT" and not bytes_scanned
+                                        and float(exec_ms or 0) <= RESULT_CACHE_MAX_EXEC_MS,
+                    }
+            cur.execute(
+                """
+                SELECT warehouse_name, start_time, end_time, credits_used
+                FROM SNOWFLAKE.ACCOUNT_USAGE.WAREHOUSE_METERING_HISTORY
+                WHERE start_time >= %(since)s
+                ORDER BY start_time
+                """,
+                {"since": since},
+            )
+            credits = cur.fetchall()
+        finally:
+            cur.close()
+    return by_query, credits
+
+
+def report(days: int = 7, snowflake: bool = False, top: int = 20) -> None:
+    since = time.time() - days * 86400
+    with _lock:
+        rows = _store().execute(
+            "SELECT ts, run_id, tag, template_id, query_id, elapsed_ms, row_count, cache, error, sql_text "
+            "FROM query_metrics WHERE ts >= ? ORDER BY ts",
+            (since,),
+        ).fetchall()
+    if not rows:
+        print(f"[query_metrics] no queries recorded in the last {days} days ({_metrics_path()})")
+        return
+
+    sf, credits = {}, []
+    if snowflake:
+        since_dt = datetime.fromtimestamp(since, tz=timezone.utc)
+        sf, credits = _fetch_snowflake_costs({r[4] for r in rows if r[4]}, since_dt)
+
+    # ---- per template
+    templates = {}
+    for ts, run_id, tag, tid, qid, ms, n, cache, error, sql_text in rows:
+        t = templates.setdefault((tag, tid), {"ms": [], "rows": 0, "hits": 0, "errors": 0, "bytes": 0,
+                                              "server_ms": 0.0, "rc_hits": 0, "sf_calls": 0, "warm": 0.0,
+                                              "sql": sql_text})
+        t["ms"].append(ms)
+        t["rows"] += n or 0
+        t["hits"] += cache == "hit"
+        t["errors"] += bool(error)
+        q = sf.get(qid)
+        if q:
+            t["sf_calls"] += 1
+            t["bytes"] += q["bytes"]
+            t["server_ms"] += q["server_ms"]
+            t["rc_hits"] += q["result_cache"]
+            t["warm"] += q["pct_cache"]
+
+    print(f"\n=== Per query template (last {days} days, by total time) ===")
+    hdr = f"{'tag':<26} {'template':<12} {'calls':>6} {'hit%':>5} {'p50 ms':>8} {'p95 ms':>8} {'total s':>8} {'rows':>9} {'err':>4}"
+    print(hdr + (f" {'MB scanned':>11} {'server s':>9} {'RC hit%':>8} {'WH cache%':>10}" if snowflake else ""))
+    ranked = sorted(templates.items(), key=lambda kv: -sum(kv[1]["ms"]))[:top]
+    for (tag, tid), t in ranked:
+        calls = len(t["ms"])
+        line = (
+            f"{tag[:26]:<26} {tid:<12} {calls:>6} {100 * t['hits'] / calls:>5.0f} "
+            f"{statistics.median(t['ms']):>8.0f} {_pct(t['ms'], 0.95):>8.0f} {sum(t['ms']) / 1000:>8.1f} "
+            f"{t['rows']:>9} {t['errors']:>4}"
+        )
+        if snowflake:
+            n_sf = max(t["sf_calls"], 1)
+            line += (f" {t['bytes'] / 1e6:>11.1f} {t['server_ms'] / 1000:>9.1f} "
+                     f"{100 * t['rc_hits'] / n_sf:>8.0f} {100 * t['warm'] / n_sf:>10.0f}")
+        print(line)
+    if snowflake:
+        print("hit% = app st.cache_data hits; RC hit% = Snowflake result-cache reuse; "
+              "WH cache% = avg share scanned from warehouse cache (of queries found in QUERY_HISTORY)")
+
+    # ---- per run
+    runs = {}
+    for ts, run_id, tag, tid, qid, ms, n, cache, error, sql_text in rows:
+        r = runs.setdefault(run_id, {"start": ts, "end": ts, "queries": 0, "ms": 0.0, "hits": 0, "bytes": 0,
+                                     "rc_hits": 0})
+        r["start"], r["end"] = min(r["start"], ts), max(r["end"], ts + ms / 1000)
+        r["queries"] += 1
+        r["ms"] += ms
+        r["hits"] += cache == "hit"
+        r["bytes"] += sf.get(qid, {}).get("bytes", 0)
+        r["rc_hits"] += sf.get(qid, {}).get("result_cache", False)
+
+    print(f"\n=== Per run ===")
+    hdr = f"{'run_id':<36} {'started (UTC)':<20} {'queries':>8} {'hits':>5} {'query s':>8}"
+    print(hdr + (f" {'RC hits':>8} {'MB scanned':>11} {'credits*':>9}" if snowflake else ""))
+    for run_id, r in sorted(runs.items(), key=lambda kv: kv[1]["start"]):
+        started = datetime.fromtimestamp(r["start"], tz=timezone.utc)
+        line = f"{run_id[:36]:<36} {started:%Y-%m-%d %H:%M:%S} {r['queries']:>8} {r['hits']:>5} {r['ms'] / 1000:>8.1f}"
+        if snowflake:
+            # credits of the metering hours overlapping the run (other workloads in those hours count too)
+            end = datetime.fromtimestamp(r["end"], tz=timezone.utc)
+            used = sum(
+                float(c or 0) for _, h_start, h_end, c in credits
+                if h_start <= end and h_end >= started
+            )
+            line += f" {r['rc_hits']:>8} {r['bytes'] / 1e6:>11.1f} {used:>9.3f}"
+        print(line)
+    if snowflake:
+        print("* credits = WAREHOUSE_METERING_HISTORY hours overlapping the run (shared with other workloads)")
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Report on recorded Snowflake query metrics.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rep = sub.add_parser("report")
+    rep.add_argument("--days", type=int, default=7)
+    rep.add_argument("--top", type=int, default=20)
+    rep.add_argument("--snowflake", action="store_true", help="join ACCOUNT_USAGE query + metering history")
+    args = ap.parse_args(argv)
+
+    if args.snowflake:
+        from dotenv import load_dotenv
+        load_dotenv()
+    report(days=args.days, snowflake=args.snowflake, top=args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
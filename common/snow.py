@@ -1,18 +1,69 @@
 # common/snow.py
 from __future__ import annotations
 import os
-import snowflake.connector
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
+import sys
+from typing import TYPE_CHECKING
 
-try:
-    import streamlit as st  # available on Streamlit Cloud
-except Exception:
-    st = None
+from common.circuit_breaker import CircuitOpenError, get_breaker
+
+# snowflake.connector and cryptography are imported on first connect, not at
+# import time: both are slow to load and most importers never connect.
+if TYPE_CHECKING:
+    import snowflake.connector
+
+
+# After an auth/lock/MFA failure, shed every connect in this process for this
+# long: parallel retries with bad credentials are what locks the user out.
+AUTH_LOCKOUT_SECS = 15 * 60
+
+
+def is_auth_error(e: Exception) -> bool:
+    """Snowflake auth/lock/MFA failure, raw or as the CircuitOpenError of a breaker it tripped."""
+    if isinstance(e, CircuitOpenError):
+        return e.auth and e.name == "snowflake"
+    msg = str(e).lower()
+    return (
+        "incorrect username or password" in msg
+        or "temporarily locked" in msg
+        or "mfa" in msg
+        or "authentication" in msg
+    )
+
+
+def guarded_connect(**kwargs) -> snowflake.connector.SnowflakeConnection:
+    """
+    snowflake.connector.connect() behind the process-wide "snowflake" circuit
+    breaker: raises CircuitOpenError instead of connecting while it is open.
+    """
+    import snowflake.connector
+
+    breaker = get_breaker("snowflake")
+    breaker.before_call()
+    try:
+        con = snowflake.connector.connect(**kwargs)
+    except Exception as e:
+        if is_auth_error(e):
+            breaker.trip(f"auth error: {e}", open_secs=AUTH_LOCKOUT_SECS, auth=True)
+        else:
+            breaker.record_failure(f"{type(e).__name__}: {e}")
+        raise
+    except BaseException:
+        breaker.release()  # cancelled / interrupted: no verdict on Snowflake itself
+        raise
+    breaker.record_success()
+    return con
+
+
+def _streamlit():
+    """The streamlit module if this process is a Streamlit app, else None (never imports it)."""
+    return sys.modules.get("streamlit")
 
 
 def _pem_to_pkcs8_der(pem_str: str) -> bytes:
     """Convert a PEM string to PKCS8 DER bytes for Snowflake connector."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.backends import default_backend
+
     key = serialization.load_pem_private_key(
         pem_str.encode(), password=None, backend=default_backend()
     )
@@ -36,9 +87,11 @@ def connect_snowflake(
       - On Streamlit Cloud: reads st.secrets["snowflake"]
       - Locally/Prefect:    reads environment variables
       - Prefers key-pair auth (PEM inline or file); falls back to password
+      - Connects through the shared circuit breaker (see guarded_connect)
     """
     # 1) Prefer Streamlit secrets when available
     secrets = None
+    st = _streamlit()
     if st is not None:
         try:
             secrets = st.secrets.get("snowflake", None)
@@ -67,7 +120,7 @@ def connect_snowflake(
                 "snowflake secrets found, but neither 'private_key' nor 'password' provided."
             )
 
-        return snowflake.connector.connect(**cfg)
+        return guarded_connect(**cfg)
 
     # 2) Fallback to environment variables (your original behavior)
     cfg = {
@@ -95,4 +148,4 @@ def connect_snowflake(
             "Missing auth: set SNOWFLAKE_PRIVATE_KEY_PEM or SNOWFLAKE_PRIVATE_KEY_PATH or SNOWFLAKE_PASSWORD."
         )
 
-    return snowflake.connector.connect(**cfg)
\ No newline at end of file
+    return guarded_connect(**cfg)
\ No newline at end of file
@@ -0,0 +1,106 @@
+# common/swr.py
+"""
+Stale-while-revalidate result cache with background loading.
+
+Used by the Streamlit app so a cold warehouse never blocks the whole page:
+independent queries are prefetched in parallel on a thread pool, and a section
+whose fresh result is not ready within its budget renders the last known
+result (marked stale) while the refresh finishes in the background.
+
+An entry is fresh while it is younger than fresh_secs and was loaded after the
+last invalidate_all(); anything else is served stale and reloaded.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Optional
+
+FRESH, STALE, PENDING = "fresh", "stale", "pending"
+
+
+@dataclass
+class Lookup:
+    value: Any
+    status: str                        # fresh | stale | pending
+    pending: Optional[Future] = None   # refresh in flight (stale / pending)
+    error: Optional[BaseException] = None
+
+    def wait(self, timeout: Optional[float] = None) -> "Lookup":
+        """Block until the in-flight load finishes (raises its exception)."""
+        if self.pending is None:
+            return self
+        return Lookup(self.pending.result(timeout=timeout), FRESH)
+
+
+class SWRCache:
+    def __init__(self, max_workers: int = 4, fresh_secs: float = 24 * 60 * 60, max_entries: int = 256):
+        self.fresh_secs = fresh_secs
+        self.max_entries = max_entries
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="swr")
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, loaded_at, generation)
+        self._inflight: dict = {}
+        self._generation = 0
+
+    def _is_fresh(self, entry) -> bool:
+        _, loaded_at, generation = entry
+        return generation == self._generation and time.time() - loaded_at < self.fresh_secs
+
+    def _store(self, key: Hashable, fut: Future, generation: int) -> None:
+        with self._lock:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+            if fut.exception() is None:
+                self._entries[key] = (fut.result(), time.time(), generation)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def prefetch(self, key: Hashable, fn: Callable, *args, **kwargs) -> Optional[Future]:
+        """Start loading `key` in the background unless it is fresh or already loading."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_fresh(entry):
+                return None
+            fut = self._inflight.get(key)
+            if fut is None:
+                generation = self._generation
+                fut = self._pool.submit(fn, *args, **kwargs)
+                self._inflight[key] = fut
+                fut.add_done_callback(lambda f, k=key, g=generation: self._store(k, f, g))
+            return fut
+
+    def get(self, key: Hashable, fn: Callable, *args, budget_secs: float = 0.0, **kwargs) -> Lookup:
+        """
+        Fresh value if available (or loaded within budget_secs), else the stale
+        value with the refresh still pending, else a PENDING lookup to wait on.
+        """
+        fut = self.prefetch(key, fn, *args, **kwargs)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if fut is None:
+            return Lookup(entry[0], FRESH)
+
+        try:
+            return Lookup(fut.result(timeout=budget_secs), FRESH)
+        except FutureTimeout:
+            pass
+        except Exception as e:
+            if entry is None:
+                raise
+            return Lookup(entry[0], STALE, error=e)
+
+        if entry is not None:
+            return Lookup(entry[0], STALE, pending=fut)
+        return Lookup(None, PENDING, pending=fut)
+
+    def invalidate_all(self) -> None:
+        """Mark every entry stale (they are still served while reloading)."""
+        with self._lock:
+            self._generation += 1
@@ -0,0 +1,76 @@
+{#-
+  One row per route_code x departure period (date_trunc(grain, departure_date))
+  summarising the mart, for the app sidebar and the all-routes overview.
+  Incremental: periods that received quote days in the last
+  var('rollup_lookback_days', 7) days before the newest built quote day are
+  recomputed (fully, so median/coverage stay exact) and merged back. The lookback
+  catches late rows and recent rewrites (retries, change-only carry-forward).
+  Older history rewrites (ingestion.backfill) need
+  `dbt run --full-refresh --select mart_route_rollup_weekly mart_route_rollup_monthly`.
+-#}
+{% macro route_rollup(grain) %}
+
+with src as (
+  select
+    route_code,
+    date_trunc('{{ grain }}', departure_date) as period_start,
+    departure_date,
+    quote_day,
+    daily_min_price_aud
+  from {{ ref('mart_lowest_price_by_route_date') }}
+  {% if is_incremental() %}
+  where (route_code, date_trunc('{{ grain }}', departure_date)) in (
+    select route_code, date_trunc('{{ grain }}', departure_date)
+    from {{ ref('mart_lowest_price_by_route_date') }}
+    where quote_day > (
+      select dateadd('day', -{{ var('rollup_lookback_days', 7) }}, coalesce(max(last_quote_day), '1900-01-01'::timestamp_tz))
+      from {{ this }}
+    )
+  )
+  {% endif %}
+),
+
+-- most recent quote for each departure date in the period
+latest as (
+  select route_code, period_start, daily_min_price_aud
+  from src
+  qualify row_number() over (
+    partition by route_code, departure_date
+    order by quote_day desc
+  ) = 1
+),
+
+latest_by_period as (
+  select route_code, period_start, min(daily_min_price_aud) as latest_min_price_aud
+  from latest
+  group by 1, 2
+),
+
+history_by_period as (
+  select
+    route_code,
+    period_start,
+    min(daily_min_price_aud)       as min_price_aud,
+    median(daily_min_price_aud)    as median_price_aud,
+    count(distinct departure_date) as days_of_coverage,
+    count(distinct quote_day)      as quote_days,
+    max(quote_day)                 as last_quote_day
+  from src
+  group by 1, 2
+)
+
+select
+  h.route_code,
+  h.period_start::date as period_start,
+  h.min_price_aud,
+  h.median_price_aud,
+  l.latest_min_price_aud,
+  h.days_of_coverage,
+  h.quote_days,
+  h.last_quote_day
+from history_by_period h
+join latest_by_period l
+  on l.route_code = h.route_code
+ and l.period_start = h.period_start
+
+{% endmacro %}
@@ -1,3 +1,14 @@
+{#-
+  Change-only ingestion (CHANGE_ONLY=1) writes a row only when a quote changes,
+  plus a heartbeat every CHANGE_HEARTBEAT_DAYS, and stamps that heartbeat on the
+  row as CARRY_DAYS. Each daily row is carried forward over the following quote
+  days until the next row for the same route/departure, for at most its own
+  carry_days. Full snapshots have carry_days = 1 (no carry-forward), so rebuilds
+  read history the way it was written, whatever the current settings.
+  A tombstone (price NULL: the key was no longer observed) ends the
+  carry-forward and is not output itself.
+-#}
+
 with base as (
   select
     route_code,
@@ -10,7 +21,9 @@ with base as (
     stops,
     airline_code,
     source,
-    cabin
+    cabin,
+    carry_days,
+    is_tombstone
   from {{ ref('stg_price_quotes_parsed') }}
 ),
 
@@ -20,22 +33,63 @@ ranked as (
     *,
     row_number() over (
       partition by route_code, departure_date, quote_day
-      order by price_aud asc, quote_ts desc
-    ) as rn
+      order by price_aud asc nulls last, quote_ts desc
+    ) as rn,
+    -- the key went unobserved later that day: do not carry the quote past it
+    last_value(is_tombstone) over (
+      partition by route_code, departure_date, quote_day
+      order by quote_ts
+      rows between unbounded preceding and unbounded following
+    ) as ends_unobserved
   from base
+),
+
+-- how many quote days each observed row stands for (1 = itself only);
+-- tombstone days count as rows, so the previous quote stops before them
+spans as (
+  select
+    *,
+    case when ends_unobserved then 1 else least(
+      coalesce(
+        datediff(
+          'day',
+          quote_day,
+          lead(quote_day) over (partition by route_code, departure_date order by quote_day)
+        ),
+        carry_days
+      ),
+      carry_days
+    ) end as span_days
+  from ranked
+  where rn = 1
+),
+
+day_offsets as (
+  select row_number() over (order by seq4()) - 1 as n
+  from table(generator(rowcount => 366))
 )
 
 select
-  route_code,
-  origin,
-  destination,
-  departure_date,
-  quote_day,
-  price_aud as daily_min_price_aud,
-  stops,
-  airline_code,
-  source,
-  cabin,
-  quote_ts as observed_at
-from ranked
-where rn = 1
\ No newline at end of file
+  s.route_code,
+  s.origin,
+  s.destination,
+  s.departure_date,
+  dateadd('day', o.n, s.quote_day) as quote_day,
+  s.price_aud as daily_min_price_aud,
+  s.stops,
+  s.airline_code,
+  s.source,
+  s.cabin,
+  s.quote_ts as observed_at,
+  o.n > 0 as is_carried_forward
+from spans s
+join day_offsets o
+  on o.n < s.span_days
+ and (
+      o.n = 0
+      or (
+        dateadd('day', o.n, s.quote_day)::date <= s.departure_date
+        and dateadd('day', o.n, s.quote_day)::date <= current_date()
+      )
+ )
+where not s.is_tombstone
@@ -9,5 +9,6 @@ select
   airline_code,
   source,
   cabin,
-  observed_at
+  observed_at,
+  is_carried_forward
 from {{ ref('core_daily_quotes') }}
\ No newline at end of file
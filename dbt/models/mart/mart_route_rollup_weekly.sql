@@ -0,0 +1,7 @@
+{{ config(
+    materialized='incremental',
+    unique_key=['route_code', 'period_start'],
+    incremental_strategy='merge'
+) }}
+
+{{ route_rollup('week') }}
@@ -9,7 +9,10 @@ with src as (
         cast(STOPS as int)                as stops,
         cast(AIRLINE_CODE as string)      as airline_code,
         cast(SOURCE as string)            as source,
-        cast(CABIN as string)             as cabin
+        cast(CABIN as string)             as cabin,
+        cast(CARRY_DAYS as int)           as carry_days,
+        -- change-only ingestion writes price NULL when a quoted key is no longer observed
+        PRICE_AUD is null and CARRY_DAYS is not null as is_tombstone
     from {{ source('raw', 'PRICE_QUOTES_PARSED') }}
 
 )
@@ -24,5 +27,7 @@ select
   coalesce(stops, 0)                    as stops,
   airline_code,
   source,
-  cabin
+  cabin,
+  coalesce(carry_days, 1)               as carry_days,
+  is_tombstone
 from src
\ No newline at end of file
@@ -0,0 +1,310 @@
+# ingestion/backfill.py
+"""
+Rebuild RAW.PRICE_QUOTES_PARSED from archived API responses (no API calls).
+
+Reads the original /v2/search responses either from Snowflake
+RAW.PRICE_QUOTES_JSON (streamed in Arrow batches) or from local NDJSON spool
+files, re-parses them in a process pool with the same parser as live ingestion,
+and bulk-MERGEs the rows back (idempotent on origin/destination/departure_date/quote_ts).
+
+Spool files: one JSON object per line with keys ingested_at, route_code,
+params, response (upper-case keys, as exported by snowsql, also work; .gz ok).
+
+Usage:
+  python -m ingestion.backfill --snowflake --since 2025-10-01 --until 2025-11-01
+  python -m ingestion.backfill --spool spool/*.ndjson --workers 8
+  python -m ingestion.backfill --spool spool/*.ndjson --dry-run   # parse only
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date, datetime
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from common.query_metrics import execute as timed_execute
+from ingestion.providers.tequila import parse_min_price
+
+DEFAULT_CHUNK_SIZE = 2_000     # records per worker task
+DEFAULT_LOAD_ROWS  = 20_000    # parsed rows per MERGE
+
+# (ingested_at, route_code, params, response); params/response may still be JSON text
+Record = Tuple[object, str, object, object]
+# Same tuple order as insert_quotes(): (origin, destination, departure_date, observed_at, price_aud, stops, airline_code, source)
+QuoteRow = Tuple[str, str, date, datetime, float, Optional[int], Optional[str], str]
+
+
+# ----------------------------- Parsing (runs in workers) -----------------------------
+def _field(obj: dict, name: str):
+    return obj[name] if name in obj else obj.get(name.upper())
+
+def _as_json(value):
+    return json.loads(value) if isinstance(value, (str, bytes)) else (value or {})
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    # snowsql exports "2025-10-01 01:00:03.123 +1100"; NDJSON spools use ISO-8601
+    text = str(value).strip().replace("Z", "+00:00")
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return datetime.strptime(text, "%Y-%m-%d %H:%M:%S.%f %z")
+
+def parse_record(record, source: str) -> Optional[QuoteRow]:
+    """Turn one archived response into a PRICE_QUOTES_PARSED row (None if no fare)."""
+    if isinstance(record, (str, bytes)):
+        obj = json.loads(record)
+        record = (
+            _field(obj, "ingested_at"),
+            _field(obj, "route_code"),
+            _field(obj, "params"),
+            _field(obj, "response"),
+        )
+    ingested_at, route_code, params, response = record
+
+    params = _as_json(params)
+    price, stops, airline = parse_min_price(_as_json(response))
+    if price is None or not params.get("date_from"):
+        return None
+
+    origin, destination = params.get("fly_from"), params.get("fly_to")
+    if not (origin and destination) and route_code and "-" in route_code:
+        origin, destination = route_code.strip().upper().split("-", 1)
+
+    dep = datetime.strptime(params["date_from"], "%d/%m/%Y").date()
+    return (
+        str(origin).upper(),
+        str(destination).upper(),
+        dep,
+        _as_datetime(ingested_at),
+        float(price),
+        int(stops) if stops is not None else None,
+        airline,
+        source,
+    )
+
+def _parse_chunk(records: Sequence, source: str) -> Tuple[List[QuoteRow], int]:
+    """Worker entrypoint: returns (rows, skipped) for one chunk."""
+    rows: List[QuoteRow] = []
+    skipped = 0
+    for rec in records:
+        try:
+            row = parse_record(rec, source)
+        except (ValueError, KeyError, TypeError):
+            row = None
+        if row is None:
+            skipped += 1
+        else:
+            rows.append(row)
+    return rows, skipped
+
+
+# ----------------------------- Sources -----------------------------
+def _chunked(items: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_spool_records(paths: Sequence[str], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[list]:
+    """Yield chunks of raw NDJSON lines; JSON decoding happens in the workers."""
+    def lines():
+        for path in paths:
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield line
+    return _chunked(lines(), chunk_size)
+
+def iter_snowflake_records(
+    con,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    routes: Optional[Sequence[str]] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[list]:
+    """
+    Stream RAW.PRICE_QUOTES_JSON as chunks of Record tuples.
+    Uses Arrow result batches when pyarrow is available, else fetchmany().
+    """
+    where, params = ["1=1"], {}
+    if since:
+        where.append("INGESTED_AT >= %(since)s")
+        params["since"] = since
+    if until:
+        where.append("INGESTED_AT < %(until)s")
+        params["until"] = until
+    if routes:
+        where.append("ROUTE_CODE IN (%(routes)s)")
+        params["routes"] = [r.upper() for r in routes]
+    sql = f"""
+    SELECT INGESTED_AT, ROUTE_CODE, TO_JSON(PARAMS) AS PARAMS, TO_JSON(RESPONSE) AS RESPONSE
+    FROM FLIGHT_DB.RAW.PRICE_QUOTES_JSON
+    WHERE {' AND '.join(where)}
+    ORDER BY INGESTED_AT
+    """
+
+    cur = con.cursor()
+    try:
+        timed_execute(cur, sql, params, tag="backfill.read_json")
+        try:
+            batches = cur.fetch_arrow_batches()
+        except Exception:  # pyarrow not installed / result format not Arrow
+            batches = None
+
+        if batches is not None:
+            def records():
+                for table in batches:
+                    cols = [table.column(i).to_pylist() for i in range(4)]
+                    yield from zip(*cols)
+            yield from _chunked(records(), chunk_size)
+        else:
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [tuple(r) for r in rows]
+    finally:
+        cur.close()
+
+
+# ----------------------------- Replay pipeline -----------------------------
+class _Progress:
+    """Prints a one-line status at most every `every` seconds."""
+
+    def __init__(self, every: float = 5.0):
+        self.every = every
+        self.started = self.last = time.monotonic()
+        self.records = self.rows = self.skipped = self.loaded = 0
+
+    def update(self, rows: int, skipped: int) -> None:
+        self.rows += rows
+        self.skipped += skipped
+        self.records += rows + skipped
+        if time.monotonic() - self.last >= self.every:
+            self.print()
+
+    def print(self, final: bool = False) -> None:
+        self.last = time.monotonic()
+        elapsed = max(self.last - self.started, 1e-9)
+        tag = "done" if final else "progress"
+        print(
+            f"[backfill] {tag} records={self.records} parsed={self.rows} skipped={self.skipped} "
+            f"loaded={self.loaded} elapsed={elapsed:.1f}s rate={self.records / elapsed:,.0f} rec/s"
+        )
+
+def replay(
+    chunks: Iterable[list],
+    source: str,
+    workers: int = 1,
+    load=None,
+    load_rows: int = DEFAULT_LOAD_ROWS,
+    progress: Optional[_Progress] = None,
+) -> _Progress:
+    """
+    Parse `chunks` in a process pool and hand parsed rows to `load(rows) -> int`
+    in batches of ~load_rows. At most 2*workers chunks are in flight, so memory
+    stays flat no matter how large the archive is.
+    """
+    progress = progress or _Progress()
+    buffer: List[QuoteRow] = []
+
+    def flush():
+        if buffer and load is not None:
+            progress.loaded += load(list(buffer))
+        buffer.clear()
+
+    def consume(rows: List[QuoteRow], skipped: int):
+        buffer.extend(rows)
+        progress.update(len(rows), skipped)
+        if len(buffer) >= load_rows:
+            flush()
+
+    if workers <= 1:
+        for chunk in chunks:
+            consume(*_parse_chunk(chunk, source))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending: deque[Future] = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(_parse_chunk, chunk, source))
+                if len(pending) >= 2 * workers:
+                    consume(*pending.popleft().result())
+            while pending:
+                consume(*pending.popleft().result())
+
+    flush()
+    progress.print(final=True)
+    return progress
+
+
+# ----------------------------- CLI -----------------------------
+def _parse_date(value: str) -> date:
+    return date.fromisoformat(value)
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Re-parse archived API responses into RAW.PRICE_QUOTES_PARSED.")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--snowflake", action="store_true", help="read RAW.PRICE_QUOTES_JSON")
+    src.add_argument("--spool", nargs="+", metavar="FILE", help="read local NDJSON spool files")
+    ap.add_argument("--since", type=_parse_date, help="INGESTED_AT >= date (Snowflake source)")
+    ap.add_argument("--until", type=_parse_date, help="INGESTED_AT < date (Snowflake source)")
+    ap.add_argument("--routes", help="comma-separated route codes, e.g. MEL-BKK,MEL-PNH (Snowflake source)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    ap.add_argument("--load-rows", type=int, default=DEFAULT_LOAD_ROWS)
+    ap.add_argument("--source", default=os.environ.get("SOURCE_NAME", "tequila"))
+    ap.add_argument("--dry-run", action="store_true", help="parse only, do not write to Snowflake")
+    args = ap.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    print(f"[backfill] source={'snowflake' if args.snowflake else 'spool'} workers={args.workers} "
+          f"chunk_size={args.chunk_size} dry_run={args.dry_run}")
+
+    need_sf = args.snowflake or not args.dry_run
+    if not need_sf:
+        progress = replay(iter_spool_records(args.spool, args.chunk_size), args.source, args.workers)
+        return progress.rows
+
+    # one session for reads and loads: the bulk MERGE reuses its temp stage table
+    from common.snow import connect_snowflake
+    from ingestion.utils.snowflake_io import merge_quotes_bulk
+
+    with connect_snowflake() as con:
+        if args.snowflake:
+            # a separate read cursor streams while the load cursor MERGEs
+            chunks = iter_snowflake_records(
+                con,
+                since=args.since,
+                until=args.until,
+                routes=[r.strip() for r in args.routes.split(",")] if args.routes else None,
+                chunk_size=args.chunk_size,
+            )
+        else:
+            chunks = iter_spool_records(args.spool, args.chunk_size)
+
+        load = None if args.dry_run else (lambda rows: merge_quotes_bulk(rows, con))
+        progress = replay(chunks, args.source, args.workers, load=load, load_rows=args.load_rows)
+    if not args.dry_run and progress.loaded:
+        # the incremental rollups only look back a few quote days
+        print("[backfill] history rewritten: rebuild the rollups with "
+              "dbt run --project-dir dbt --full-refresh --select mart_route_rollup_weekly mart_route_rollup_monthly, "
+              "then re-export the lake with python -m common.lake export --full")
+    return progress.loaded if not args.dry_run else progress.rows
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,58 @@
-import os, json
-from datetime import date, datetime, timedelta, timezone
-from typing import List, Tuple
-from dotenv import load_dotenv
-import snowflake.connector  # <-- NEW
+import os, json, time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
 
-from ingestion.providers.tequila import fetch_min_price
-from ingestion.utils.snowflake_io import insert_quotes, insert_raw_json
+from common.query_metrics import execute as timed_execute
 
-load_dotenv()  # keep secrets/config out of code
+# Nothing here touches the network or reads .env at import time: the Prefect
+# flow imports this module lazily and tests import it without credentials.
+# snowflake.connector / the Tequila provider are imported inside functions.
 
-# ----------------------- Defaults / fallbacks -----------------------
-ORIGIN = os.environ.get("ORIGIN", "MEL").upper()
 DEFAULT_DESTS = "BKK,PNH,SGN,MNL,HND,ICN"
-DESTINATIONS = os.environ.get("DESTINATIONS", DEFAULT_DESTS)
-DEST_LIST: List[str] = [d.strip().upper() for d in DESTINATIONS.split(",") if d.strip()]
+SHED_RETRIES = 3  # run_once: re-runs of the shed dates only, each after the breaker cool-down
 
-ROUTES_CSV = os.environ.get("ROUTES_CSV", "").strip()
+# ----------------------- Config (explicit, read on demand) -----------------------
+@dataclass(frozen=True)
+class IngestionConfig:
+    origin: str = "MEL"
+    destinations: Tuple[str, ...] = tuple(DEFAULT_DESTS.split(","))
+    routes_csv: str = ""
+    horizon_days: int = 60
+    store_json: bool = False
+    source_name: str = "tequila"
+    routes_cache_path: Path = Path(".routes_cache.json")
+    routes_cache_ttl_secs: int = 24 * 60 * 60
+    change_only: bool = False
+    change_state_path: Path = Path(".change_state.sqlite")
+    change_heartbeat_days: int = 7
 
-HORIZON_DAYS = int(os.environ.get("HORIZON_DAYS", "60"))
-STORE_JSON   = os.environ.get("STORE_JSON", "0") == "1"
-SOURCE_NAME  = os.environ.get("SOURCE_NAME", "tequila")
+def load_config() -> IngestionConfig:
+    """Load .env (keeps secrets/config out of code) and build the run config."""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    dests = os.environ.get("DESTINATIONS", DEFAULT_DESTS)
+    return IngestionConfig(
+        origin=os.environ.get("ORIGIN", "MEL").upper(),
+        destinations=tuple(d.strip().upper() for d in dests.split(",") if d.strip()),
+        routes_csv=os.environ.get("ROUTES_CSV", "").strip(),
+        horizon_days=int(os.environ.get("HORIZON_DAYS", "60")),
+        store_json=os.environ.get("STORE_JSON", "0") == "1",
+        source_name=os.environ.get("SOURCE_NAME", "tequila"),
+        routes_cache_path=Path(os.environ.get("ROUTES_CACHE_PATH", ".routes_cache.json")),
+        routes_cache_ttl_secs=int(os.environ.get("ROUTES_CACHE_TTL_SECS", str(24 * 60 * 60))),
+        change_only=os.environ.get("CHANGE_ONLY", "0") == "1",
+        change_state_path=Path(os.environ.get("CHANGE_STATE_PATH", ".change_state.sqlite")),
+        change_heartbeat_days=int(os.environ.get("CHANGE_HEARTBEAT_DAYS", "7")),
+    )
 
 # ----------------------- Snowflake connection (for reading routes) -----------------------
 def _sf_connect():
     """Tiny helper: connect using the same .env vars you already set."""
+    from common.snow import guarded_connect  # lazy: connector loads only on a cache miss
+
     kwargs = dict(
         account=os.environ["SNOWFLAKE_ACCOUNT"],
         user=os.environ["SNOWFLAKE_USER"],
@@ -41,7 +70,7 @@ def _sf_connect():
         if not pwd:
             raise RuntimeError("Snowflake auth not configured: set PRIVATE_KEY_PATH or PASSWORD")
         kwargs["password"] = pwd
-    return snowflake.connector.connect(**kwargs)
+    return guarded_connect(**kwargs)
 
 def fetch_supported_routes_from_sf() -> List[Tuple[str, str]]:
     """
@@ -52,7 +81,7 @@ def fetch_supported_routes_from_sf() -> List[Tuple[str, str]]:
     with _sf_connect() as con:
         cur = con.cursor()
         try:
-            cur.execute(sql)
+            timed_execute(cur, sql, tag="ingest.routes")
             rows = [r[0] for r in cur.fetchall()]
         finally:
             cur.close()
@@ -64,12 +93,28 @@ def fetch_supported_routes_from_sf() -> List[Tuple[str, str]]:
         pairs.append((o, d))
     return pairs
 
+# ----------------------- Local route cache (JSON file + TTL) -----------------------
+def _read_route_cache(path: Path, ttl_secs: int) -> Optional[List[Tuple[str, str]]]:
+    try:
+        payload = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+    if time.time() - float(payload.get("fetched_at", 0)) > ttl_secs:
+        return None
+    return [(o, d) for o, d in payload.get("routes", [])] or None
+
+def _write_route_cache(path: Path, pairs: List[Tuple[str, str]]) -> None:
+    try:
+        path.write_text(json.dumps({"fetched_at": time.time(), "routes": pairs}))
+    except OSError as e:
+        print(f"[ingestion] WARN could not write route cache {path}: {e}")
+
 # ----------------------- Build ROUTES (DB first, then fallbacks) -----------------------
-def build_routes() -> List[Tuple[str, str]]:
+def build_routes(config: IngestionConfig) -> List[Tuple[str, str]]:
     # 1) explicit override via ROUTES_CSV like "MEL-BKK;MEL-PNH"
-    if ROUTES_CSV:
+    if config.routes_csv:
         pairs = []
-        for token in ROUTES_CSV.split(";"):
+        for token in config.routes_csv.split(";"):
             token = token.strip().upper()
             if not token:
                 continue
@@ -79,35 +124,68 @@ def build_routes() -> List[Tuple[str, str]]:
         if pairs:
             return pairs
 
-    # 2) try Snowflake DIM_SUPPORTED_ROUTES
+    # 2) local cache of DIM_SUPPORTED_ROUTES, then Snowflake itself
+    cached = _read_route_cache(config.routes_cache_path, config.routes_cache_ttl_secs)
+    if cached:
+        return cached
     try:
         pairs = fetch_supported_routes_from_sf()
         if pairs:
+            _write_route_cache(config.routes_cache_path, pairs)
             return pairs
     except Exception as e:
         print(f"[ingestion] WARN could not read DIM_SUPPORTED_ROUTES from Snowflake: {e}")
 
     # 3) fallback to ORIGIN + DESTINATIONS from env
-    return [(ORIGIN, d) for d in DEST_LIST]
+    return [(config.origin, d) for d in config.destinations]
 
-ROUTES: List[Tuple[str, str]] = build_routes()
+def get_routes(config: IngestionConfig) -> Tuple[Tuple[str, str], ...]:
+    """
+    Routes for a run, resolved on use (not at import). No in-process memo: the
+    route file cache is the only cache, so long-lived workers honour ROUTES_CACHE_TTL_SECS.
+    """
+    return tuple(build_routes(config))
 
 # ----------------------------- Main run loop ----------------------------------
-def run_once():
+def run_units(units, config: Optional[IngestionConfig] = None) -> int:
+    """
+    Fetch + load a list of sharding.WorkUnit (one route over a departure-date range).
+    run_once() is all units in one process; sharded workers call this per claimed unit.
+
+    Nothing is fetched while the "snowflake" breaker is open: the rows could not
+    be loaded anyway. Fetches shed by an open "tequila" breaker are skipped, the
+    fetched rows are loaded, and sharding.UnitShed is raised with the shed dates
+    as `remaining` units, so callers only re-fetch those (a queue worker
+    enqueues them, run_once waits out the cool-down and re-runs them). If the
+    load itself is shed, nothing was written and the whole batch is re-fetched
+    on retry.
+    """
+    from common.circuit_breaker import CircuitOpenError, get_breaker
+    from ingestion.providers.tequila import fetch_min_price
+    from ingestion.sharding import UnitShed, WorkUnit
+    from ingestion.utils.snowflake_io import insert_raw_json
+
+    config = config or load_config()
+    get_breaker("snowflake").raise_if_open()
     now = datetime.now(timezone.utc)
-    pretty_routes = ", ".join([f"{o}->{d}" for (o, d) in ROUTES])
-    print(f"[ingestion] source={SOURCE_NAME} horizon_days={HORIZON_DAYS}")
-    print(f"[ingestion] routes={pretty_routes}")
-    if STORE_JSON:
-        print("[ingestion] raw JSON snapshot storage: ON")
 
     batch = []
-    for origin, dest in ROUTES:
-        for i in range(1, HORIZON_DAYS + 1):
-            dep = date.today() + timedelta(days=i)
+    unobserved = []  # (origin, dest, dep, quote_ts, source) fetched without a price
+    shed: Optional[CircuitOpenError] = None
+    remaining = []
+    for unit in units:
+        origin, dest = unit.origin, unit.destination
+        shed_dates = []
+        for dep in unit.departure_dates():
             # fetch_min_price must return: (price, stops, airline, params_dict, response_dict)
-            price, stops, airline, params, raw = fetch_min_price(origin, dest, dep)
+            try:
+                price, stops, airline, params, raw = fetch_min_price(origin, dest, dep)
+            except CircuitOpenError as e:
+                shed = e
+                shed_dates.append(dep)
+                continue
             if price is None:
+                unobserved.append((origin, dest, dep, now, config.source_name))
                 continue
 
             # rows for RAW.PRICE_QUOTES_PARSED
@@ -120,17 +198,90 @@ def run_once():
                     float(price),
                     int(stops) if stops is not None else None,
                     airline,
-                    SOURCE_NAME,
+                    config.source_name,
                 )
             )
 
             # ⬇️ UPDATED: pass dicts directly to VARIANT columns + proper timestamp col
-            if STORE_JSON and raw:
+            if config.store_json and raw:
                 insert_raw_json(f"{origin}-{dest}", params, raw, now)
+        if shed_dates:
+            remaining.append(WorkUnit(origin, dest, min(shed_dates), max(shed_dates)))
 
-    n = insert_quotes(batch) if batch else 0
+    try:
+        n = _load_batch(batch, config, unobserved)
+    except CircuitOpenError:
+        print(f"[ingestion] load of {len(batch)} rows shed by open circuit; nothing written, units will be re-fetched")
+        raise
+    if shed is not None:
+        shed_count = sum(len(u.departure_dates()) for u in remaining)
+        print(f"[ingestion] loaded {n} rows; up to {shed_count} fetches shed by open circuit '{shed.name}'")
+        raise UnitShed(shed, remaining, n)
+    return n
+
+def _load_batch(batch, config: IngestionConfig, unobserved=()) -> int:
+    from ingestion.utils.snowflake_io import insert_quotes
+
+    if not config.change_only:
+        return insert_quotes(batch) if batch else 0
+
+    # change-only mode: skip rows identical to the last written quote (heartbeat aside)
+    from ingestion.utils.change_state import ChangeState
+
+    state = ChangeState(str(config.change_state_path), config.change_heartbeat_days)
+    try:
+        # keys that had a quote but none this run: a tombstone ends their carry-forward
+        gone = state.tombstones(list(unobserved))
+        changed = state.filter_changed(batch) + gone
+        print(f"[ingestion] change-only: {len(changed) - len(gone)}/{len(batch)} quotes changed or due a heartbeat, "
+              f"{len(gone)} tombstones")
+        n = insert_quotes(changed, carry_days=config.change_heartbeat_days) if changed else 0
+        state.mark_written(changed)
+        return n
+    finally:
+        state.close()
+
+def check_shardable(config: IngestionConfig) -> None:
+    """Sharded / queued runs cannot share the change-only state file: refuse them."""
+    if config.change_only:
+        raise ValueError(
+            "CHANGE_ONLY=1 keeps its state in a local file and only works for single-node "
+            "ingestion (python -m ingestion.main / daily flow); unset it for sharded runs."
+        )
+
+def run_once(config: Optional[IngestionConfig] = None):
+    from ingestion.sharding import UnitShed, plan_work_units
+
+    config = config or load_config()
+    routes = get_routes(config)
+
+    pretty_routes = ", ".join([f"{o}->{d}" for (o, d) in routes])
+    print(f"[ingestion] source={config.source_name} horizon_days={config.horizon_days}")
+    print(f"[ingestion] routes={pretty_routes}")
+    if config.store_json:
+        print("[ingestion] raw JSON snapshot storage: ON")
+    if config.change_only:
+        print(f"[ingestion] change-only writes: ON (heartbeat every {config.change_heartbeat_days}d)")
+
+    # one unit per route covering the whole horizon
+    units = plan_work_units(routes, config.horizon_days, chunk_days=max(config.horizon_days, 1))
+    n = 0
+    for attempt in range(1, SHED_RETRIES + 2):
+        try:
+            n += run_units(units, config)
+            break
+        except UnitShed as e:
+            n += e.rows_loaded
+            if e.auth or attempt > SHED_RETRIES:
+                print(f"[ingestion] giving up after {attempt} attempt(s): {len(e.remaining)} units still shed "
+                      f"by circuit '{e.name}' ({n} rows loaded)")
+                raise
+            print(f"[ingestion] re-running {len(e.remaining)} shed units in {e.retry_after:.0f}s "
+                  f"(retry {attempt}/{SHED_RETRIES})")
+            time.sleep(e.retry_after)
+            units = e.remaining
     print(f"Ingestion complete: inserted {n} rows.")
     return n
 
 if __name__ == "__main__":
-    run_once()
\ No newline at end of file
+    run_once()
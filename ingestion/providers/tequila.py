@@ -2,12 +2,28 @@ import os, time, requests
 from datetime import date
 from typing import Optional, Tuple
 
+from common.circuit_breaker import OPEN, get_breaker
+
 BASE_URL = "https://tequila-api.kiwi.com"
 
+def parse_min_price(data: dict) -> Tuple[Optional[float], Optional[int], Optional[str]]:
+    """
+    Extract (price_aud, stops, airline_code) from a /v2/search response.
+    Shared by live ingestion and the backfill replay of RAW.PRICE_QUOTES_JSON.
+    """
+    if not data or not data.get("data"):
+        return None, None, None
+    first = data["data"][0]
+    price = float(first.get("price"))
+    stops = max(0, len(first.get("route", [])) - 1)
+    airline = first.get("airlines", [None])[0]
+    return price, stops, airline
+
 def fetch_min_price(origin: str, destination: str, dep_date: date) -> Tuple[Optional[float], Optional[int], Optional[str], dict, dict]:
     """
     Returns: (price_aud, stops, airline_code, params_used, raw_json)
     None price means: no data or request failed.
+    Raises CircuitOpenError when the shared "tequila" breaker is open (call shed).
     """
 
     # Charger la clé API à chaque appel (pas au moment de l'import)
@@ -31,25 +47,42 @@ def fetch_min_price(origin: str, destination: str, dep_date: date) -> Tuple[Opti
         "adults": 1,
     }
 
+    breaker = get_breaker("tequila")
+    breaker.before_call()
+    try:
+        return _search_with_retries(breaker, headers, params, origin, destination, dep_date)
+    except Exception as e:
+        # every exit must record an outcome, or a reserved half-open probe is never returned
+        breaker.record_failure(f"{type(e).__name__}: {e}")
+        raise
+    except BaseException:
+        breaker.release()  # cancelled / interrupted: no verdict on Tequila itself
+        raise
+
+def _search_with_retries(breaker, headers: dict, params: dict, origin: str, destination: str, dep_date: date):
     # simple retry (handles transient 429/5xx)
     for attempt in range(3):
+        if attempt and breaker.state == OPEN:
+            break  # tripped by concurrent calls meanwhile: stop burning retries
         try:
             r = requests.get(f"{BASE_URL}/v2/search", headers=headers, params=params, timeout=25)
             if r.status_code == 200:
                 data = r.json()
-                if not data or not data.get("data"):
-                    return None, None, None, params, data or {}
-                first = data["data"][0]
-                price = float(first.get("price"))
-                stops = max(0, len(first.get("route", [])) - 1)
-                airline = first.get("airlines", [None])[0]
-                return price, stops, airline, params, data
+                price, stops, airline = parse_min_price(data)
+                breaker.record_success()
+                return price, stops, airline, params, data or {}
             else:
+                if r.status_code in (401, 403):
+                    breaker.trip(f"HTTP {r.status_code} from Tequila (check TEQUILA_API_KEY)",
+                                 open_secs=600, auth=True)
+                    return None, None, None, params, {}
                 if r.status_code in (429, 500, 502, 503, 504):
                     time.sleep(1 + attempt)  # backoff
                     continue
+                breaker.record_success()  # request-specific 4xx: the API itself is up
                 return None, None, None, params, {}
         except requests.RequestException:
             time.sleep(1 + attempt)
 
-    return None, None, None, params, {}
\ No newline at end of file
+    breaker.record_failure(f"no response after retries ({origin}-{destination} {dep_date})")
+    return None, None, None, params, {}
@@ -0,0 +1,507 @@
+# ingestion/sharding.py
+"""
+Split the route x horizon grid into work units and spread them over workers.
+
+Two ways to run N workers without duplicate fetches:
+  - static shards:  worker i of N takes the units rendezvous-hashed to it
+                    (deterministic, no coordination, no failover)
+  - work queue:     units are enqueued in a table; workers claim them with a
+                    lease, ack when loaded, and expired leases (crashed or hung
+                    workers) are handed to the next worker that asks.
+
+The queue runs on Snowflake (FLIGHT_DB.RAW.INGEST_WORK_QUEUE) for multi-node
+runs, or on a local SQLite file for single-machine runs and the test harness.
+A unit whose lease expired after it was loaded (slow ack) is fetched again by
+another worker under a new quote_ts: RAW keeps both snapshots for those dates,
+and core_daily_quotes still reduces them to one quote per day.
+
+Usage:
+  python -m ingestion.sharding plan   --queue snowflake            # enqueue today's units
+  python -m ingestion.sharding work   --queue snowflake --worker-id node-a
+  python -m ingestion.sharding work   --shard 2/4                  # static shard, no queue
+  python -m ingestion.sharding simulate --workers 4                # local multi-process harness
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import re
+import socket
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from common.circuit_breaker import CircuitOpenError
+from common.query_metrics import execute as timed_execute
+
+DEFAULT_CHUNK_DAYS = 7
+DEFAULT_LEASE_SECS = 15 * 60
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_SHED_DEADLINE_SECS = 30 * 60  # a worker gives up after being shed this long in a row
+
+SNOWFLAKE_QUEUE_TABLE = "FLIGHT_DB.RAW.INGEST_WORK_QUEUE"
+SQLITE_QUEUE_TABLE = "INGEST_WORK_QUEUE"
+
+# Lease times come from the database clock, never the worker's: with skewed
+# node clocks, leases would expire early (double fetches) or never.
+DB_NOW_EPOCH = {
+    "snowflake": "(DATE_PART(epoch_millisecond, CURRENT_TIMESTAMP()) / 1000)",
+    "sqlite": "((julianday('now') - 2440587.5) * 86400.0)",
+}
+
+
+# ----------------------------- Planning -----------------------------
+@dataclass(frozen=True)
+class WorkUnit:
+    """One route over an inclusive range of departure dates."""
+    origin: str
+    destination: str
+    start: date
+    end: date
+
+    @property
+    def unit_id(self) -> str:
+        return f"{self.origin}-{self.destination}:{self.start.isoformat()}:{self.end.isoformat()}"
+
+    def departure_dates(self) -> List[date]:
+        return [self.start + timedelta(days=i) for i in range((self.end - self.start).days + 1)]
+
+class UnitShed(CircuitOpenError):
+    """
+    Part of a unit was shed by an open breaker. The fetched dates were loaded
+    (rows_loaded); `remaining` covers the shed dates, to be queued as new units
+    instead of re-fetching the whole unit.
+    """
+
+    def __init__(self, cause: CircuitOpenError, remaining: List["WorkUnit"], rows_loaded: int):
+        super().__init__(cause.name, cause.retry_after, cause.reason, auth=cause.auth)
+        self.remaining = remaining
+        self.rows_loaded = rows_loaded
+
+def plan_work_units(
+    routes: Iterable[Tuple[str, str]],
+    horizon_days: int,
+    chunk_days: int = DEFAULT_CHUNK_DAYS,
+    today: Optional[date] = None,
+) -> List[WorkUnit]:
+    """Departures today+1 .. today+horizon_days, cut into chunk_days ranges per route."""
+    today = today or date.today()
+    units: List[WorkUnit] = []
+    for origin, dest in routes:
+        for offset in range(1, horizon_days + 1, chunk_days):
+            start = today + timedelta(days=offset)
+            end = today + timedelta(days=min(offset + chunk_days - 1, horizon_days))
+            units.append(WorkUnit(origin, dest, start, end))
+    return units
+
+def _score(unit_id: str, shard: int) -> int:
+    # hashlib, not hash(): must agree across processes and machines
+    return int.from_bytes(hashlib.sha1(f"{unit_id}|{shard}".encode()).digest()[:8], "big")
+
+def shard_of(unit: WorkUnit, shard_count: int) -> int:
+    """Rendezvous (highest-random-weight) hashing: changing N only moves ~1/N of units."""
+    return max(range(shard_count), key=lambda s: _score(unit.unit_id, s))
+
+def assign_shard(units: Sequence[WorkUnit], shard_index: int, shard_count: int) -> List[WorkUnit]:
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"shard index {shard_index} out of range for {shard_count} shards")
+    return [u for u in units if shard_of(u, shard_count) == shard_index]
+
+
+# ----------------------------- Work queue (lease / ack) -----------------------------
+class WorkQueue:
+    """
+    Lease-based queue over a DB-API connection (dialect 'snowflake' or 'sqlite').
+
+    claim() flips one pending-or-expired unit to 'leased' under a fresh token in
+    a single UPDATE, then reads it back by token; a worker that lost a race sees
+    nothing and simply claims again. ack()/release() only succeed with the token,
+    so a worker whose lease expired cannot ack over the new owner. Lease expiry
+    is stamped and compared with the database clock ({now} in the SQL).
+    """
+
+    def __init__(self, connect: Callable, dialect: str = "snowflake", table: Optional[str] = None):
+        if dialect not in ("snowflake", "sqlite"):
+            raise ValueError(f"unsupported queue dialect: {dialect}")
+        self._connect = connect
+        self.dialect = dialect
+        self.table = table or (SNOWFLAKE_QUEUE_TABLE if dialect == "snowflake" else SQLITE_QUEUE_TABLE)
+        self._con = None
+
+    @classmethod
+    def sqlite(cls, path: str) -> "WorkQueue":
+        return cls(lambda: sqlite3.connect(path, timeout=30), dialect="sqlite")
+
+    @classmethod
+    def snowflake(cls) -> "WorkQueue":
+        from common.snow import connect_snowflake
+        return cls(connect_snowflake, dialect="snowflake")
+
+    # -- plumbing
+    def _sql(self, sql: str) -> str:
+        sql = sql.replace("{table}", self.table).replace("{now}", DB_NOW_EPOCH[self.dialect])
+        if self.dialect == "sqlite":
+            sql = re.sub(r"%\((\w+)\)s", r":\1", sql)
+        return sql
+
+    def _execute(self, sql: str, params: Optional[dict] = None, many: Optional[list] = None):
+        if self._con is None:
+            self._con = self._connect()
+        cur = self._con.cursor()
+        try:
+            if self.dialect == "snowflake":
+                timed_execute(cur, self._sql(sql), many if many is not None else params,
+                              tag="shard.queue", many=many is not None)
+            elif many is not None:
+                cur.executemany(self._sql(sql), many)
+            else:
+                cur.execute(self._sql(sql), params or {})
+            rows = cur.fetchall() if cur.description else []
+            count = cur.rowcount
+            self._con.commit()
+            return rows, count
+        finally:
+            cur.close()
+
+    def close(self) -> None:
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+    # -- API
+    def ensure_table(self) -> None:
+        self._execute("""
+        CREATE TABLE IF NOT EXISTS {table} (
+            run_id           VARCHAR NOT NULL,
+            unit_id          VARCHAR NOT NULL,
+            origin           VARCHAR NOT NULL,
+            destination      VARCHAR NOT NULL,
+            start_date       DATE NOT NULL,
+            end_date         DATE NOT NULL,
+            status           VARCHAR NOT NULL,      -- pending | leased | done | failed
+            attempts         INTEGER NOT NULL,
+            lease_owner      VARCHAR,
+            lease_token      VARCHAR,
+            lease_expires_at FLOAT,                 -- epoch seconds
+            rows_loaded      INTEGER,
+            PRIMARY KEY (run_id, unit_id)
+        )
+        """)
+
+    def enqueue(self, run_id: str, units: Sequence[WorkUnit]) -> None:
+        """Idempotent: re-planning the same run_id leaves existing units (and their state) alone."""
+        rows = [
+            {"run_id": run_id, "unit_id": u.unit_id, "origin": u.origin, "destination": u.destination,
+             "start_date": u.start.isoformat(), "end_date": u.end.isoformat()}
+            for u in units
+        ]
+        if not rows:
+            return
+        if self.dialect == "sqlite":
+            sql = """
+            INSERT OR IGNORE INTO {table} (run_id, unit_id, origin, destination, start_date, end_date, status, attempts)
+            VALUES (%(run_id)s, %(unit_id)s, %(origin)s, %(destination)s, %(start_date)s, %(end_date)s, 'pending', 0)
+            """
+        else:
+            sql = """
+            MERGE INTO {table} AS tgt
+            USING (SELECT %(run_id)s AS run_id, %(unit_id)s AS unit_id, %(origin)s AS origin,
+                          %(destination)s AS destination, %(start_date)s::DATE AS start_date,
+                          %(end_date)s::DATE AS end_date) AS src
+            ON tgt.run_id = src.run_id AND tgt.unit_id = src.unit_id
+            WHEN NOT MATCHED THEN
+                INSERT (run_id, unit_id, origin, destination, start_date, end_date, status, attempts)
+                VALUES (src.run_id, src.unit_id, src.origin, src.destination, src.start_date, src.end_date, 'pending', 0)
+            """
+        self._execute(sql, many=rows)
+
+    def claim(self, run_id: str, worker_id: str, lease_secs: int = DEFAULT_LEASE_SECS,
+              max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Optional[Tuple[WorkUnit, str]]:
+        """Lease the next available unit, or None when nothing is claimable right now."""
+        token = uuid.uuid4().hex
+        claimable = """
+            run_id = %(run_id)s
+            AND status IN ('pending', 'leased')
+            AND (lease_expires_at IS NULL OR lease_expires_at < {now})
+            AND attempts < %(max_attempts)s
+        """
+        self._execute(f"""
+        UPDATE {{table}}
+        SET status = 'leased', lease_owner = %(worker)s, lease_token = %(token)s,
+            lease_expires_at = {{now}} + %(lease_secs)s, attempts = attempts + 1
+        WHERE run_id = %(run_id)s
+          AND unit_id = (SELECT MIN(unit_id) FROM {{table}} WHERE {claimable})
+          AND {claimable}
+        """, {"run_id": run_id, "worker": worker_id, "token": token,
+              "lease_secs": lease_secs, "max_attempts": max_attempts})
+
+        rows, _ = self._execute("""
+        SELECT origin, destination, start_date, end_date FROM {table}
+        WHERE run_id = %(run_id)s AND lease_token = %(token)s AND status = 'leased'
+        """, {"run_id": run_id, "token": token})
+        if not rows:
+            return None
+        o, d, s, e = rows[0]
+        return WorkUnit(o, d, _as_date(s), _as_date(e)), token
+
+    def ack(self, run_id: str, unit: WorkUnit, token: str, rows_loaded: int = 0) -> bool:
+        _, n = self._execute("""
+        UPDATE {table} SET status = 'done', lease_expires_at = NULL, rows_loaded = %(rows)s
+        WHERE run_id = %(run_id)s AND unit_id = %(unit_id)s AND lease_token = %(token)s
+        """, {"run_id": run_id, "unit_id": unit.unit_id, "token": token, "rows": rows_loaded})
+        return bool(n)
+
+    def release(self, run_id: str, unit: WorkUnit, token: str, refund_attempt: bool = False) -> None:
+        """
+        Give a unit back after a failure; it becomes claimable immediately.
+        refund_attempt: the unit was never really tried (e.g. shed by an open
+        circuit breaker), so it should not count towards max_attempts.
+        """
+        self._execute("""
+        UPDATE {table}
+        SET lease_expires_at = 0,
+            attempts = CASE WHEN %(refund)s = 1 THEN attempts - 1 ELSE attempts END
+        WHERE run_id = %(run_id)s AND unit_id = %(unit_id)s AND lease_token = %(token)s
+        """, {"run_id": run_id, "unit_id": unit.unit_id, "token": token, "refund": int(refund_attempt)})
+
+    def stats(self, run_id: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> dict:
+        """Counts by status; 'failed' includes units that ran out of attempts (pass claim()'s max_attempts)."""
+        rows, _ = self._execute("""
+        SELECT
+          CASE WHEN status <> 'done' AND attempts >= %(max_attempts)s
+                    AND (lease_expires_at IS NULL OR lease_expires_at < {now})
+               THEN 'failed' ELSE status END AS state,
+          COUNT(*)
+        FROM {table} WHERE run_id = %(run_id)s GROUP BY 1
+        """, {"run_id": run_id, "max_attempts": max_attempts})
+        return {state: int(n) for state, n in rows}
+
+    def failed_units(self, run_id: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> List[str]:
+        """unit_ids that ran out of attempts (never loaded in this run)."""
+        rows, _ = self._execute("""
+        SELECT unit_id FROM {table}
+        WHERE run_id = %(run_id)s AND status <> 'done' AND attempts >= %(max_attempts)s
+          AND (lease_expires_at IS NULL OR lease_expires_at < {now})
+        ORDER BY unit_id
+        """, {"run_id": run_id, "max_attempts": max_attempts})
+        return [r[0] for r in rows]
+
+def _as_date(value) -> date:
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
+
+
+# ----------------------------- Workers -----------------------------
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def run_worker(
+    queue: WorkQueue,
+    run_id: str,
+    process_unit: Callable[[WorkUnit], int],
+    worker_id: Optional[str] = None,
+    lease_secs: int = DEFAULT_LEASE_SECS,
+    wait_for_leases: bool = True,
+    poll_secs: float = 5.0,
+    shed_deadline_secs: float = DEFAULT_SHED_DEADLINE_SECS,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> int:
+    """
+    Claim -> process -> ack until the run is drained. Returns rows loaded.
+
+    With wait_for_leases, a worker that finds nothing claimable keeps polling
+    while other workers still hold leases, so it can pick up units whose
+    owner died once those leases expire.
+
+    A unit shed by an open breaker goes back without burning an attempt (a
+    partially fetched one is acked and its shed dates queued as a new unit),
+    and the worker waits out the cool-down. Auth failures, and a dependency
+    shed for longer than shed_deadline_secs, stop the worker by re-raising.
+    """
+    from common.snow import is_auth_error
+
+    worker_id = worker_id or default_worker_id()
+    total = 0
+    shed_since: Optional[float] = None
+    while True:
+        claimed = queue.claim(run_id, worker_id, lease_secs, max_attempts)
+        if claimed is None:
+            if wait_for_leases and queue.stats(run_id, max_attempts).get("leased"):
+                time.sleep(poll_secs)
+                continue
+            return total
+
+        unit, token = claimed
+        try:
+            n = int(process_unit(unit) or 0)
+        except CircuitOpenError as e:
+            print(f"[sharding] {worker_id} shed {unit.unit_id}: {e}")
+            remaining = getattr(e, "remaining", None)
+            if remaining and remaining != [unit]:
+                queue.enqueue(run_id, remaining)
+                if queue.ack(run_id, unit, token, e.rows_loaded):
+                    total += e.rows_loaded
+            else:
+                queue.release(run_id, unit, token, refund_attempt=True)
+            shed_since = shed_since or time.monotonic()
+            if e.auth or time.monotonic() - shed_since >= shed_deadline_secs:
+                print(f"[sharding] {worker_id} stopping: circuit '{e.name}' "
+                      f"{'tripped by an auth failure' if e.auth else 'open past the deadline'}")
+                raise
+            time.sleep(min(max(e.retry_after, poll_secs), lease_secs))
+            continue
+        except Exception as e:
+            print(f"[sharding] {worker_id} failed {unit.unit_id}: {e}")
+            queue.release(run_id, unit, token)
+            if is_auth_error(e):
+                raise  # retrying with bad credentials is what locks the user out
+            continue
+        shed_since = None
+        if queue.ack(run_id, unit, token, n):
+            total += n
+        else:
+            print(f"[sharding] {worker_id} lost lease on {unit.unit_id} (expired); its rows stay loaded; "
+                  f"a re-fetch adds a second snapshot, reduced to one per day by dbt")
+
+
+# ----------------------------- Local multi-process harness -----------------------------
+def _sim_process_unit(log_path: str, worker_id: str, crash_after: int, delay: float):
+    state = {"done": 0}
+
+    def process(unit: WorkUnit) -> int:
+        if crash_after >= 0 and state["done"] >= crash_after:
+            os._exit(1)  # die while holding the lease, like a killed node
+        time.sleep(delay)
+        con = sqlite3.connect(log_path, timeout=30)
+        with con:
+            con.execute("INSERT INTO fetch_log VALUES (?, ?)", (unit.unit_id, worker_id))
+        con.close()
+        state["done"] += 1
+        return len(unit.departure_dates())
+
+    return process
+
+def _sim_worker(queue_path: str, log_path: str, run_id: str, worker_id: str,
+                crash_after: int, lease_secs: int, delay: float) -> None:
+    queue = WorkQueue.sqlite(queue_path)
+    run_worker(queue, run_id, _sim_process_unit(log_path, worker_id, crash_after, delay),
+               worker_id=worker_id, lease_secs=lease_secs, poll_secs=0.2)
+    queue.close()
+
+def simulate(workers: int = 4, routes: int = 6, horizon_days: int = 60, chunk_days: int = DEFAULT_CHUNK_DAYS,
+             lease_secs: int = 2, delay: float = 0.05, crash: bool = True) -> bool:
+    """
+    Run `workers` processes against a temporary SQLite queue with a fake fetch.
+    Worker 0 is killed mid-lease (when `crash`); its unit must be reassigned.
+    Returns True when every unit was loaded and fetched exactly once: the crashed
+    worker dies before its fetch, so the reassigned unit is fetched only by its new owner.
+    """
+    import multiprocessing as mp
+    import tempfile
+
+    tmp = tempfile.mkdtemp(prefix="shard-sim-")
+    queue_path, log_path = os.path.join(tmp, "queue.sqlite"), os.path.join(tmp, "fetch_log.sqlite")
+    con = sqlite3.connect(log_path)
+    con.execute("CREATE TABLE fetch_log (unit_id TEXT, worker_id TEXT)")
+    con.commit()
+    con.close()
+
+    route_list = [("MEL", f"X{i:02d}") for i in range(routes)]
+    units = plan_work_units(route_list, horizon_days, chunk_days)
+    run_id = "sim"
+    queue = WorkQueue.sqlite(queue_path)
+    queue.ensure_table()
+    queue.enqueue(run_id, units)
+    queue.enqueue(run_id, units)  # re-planning must be a no-op
+
+    started = time.monotonic()
+    procs = [
+        mp.Process(target=_sim_worker, args=(queue_path, log_path, run_id, f"w{i}",
+                                             2 if (crash and i == 0) else -1, lease_secs, delay))
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    elapsed = time.monotonic() - started
+
+    con = sqlite3.connect(log_path)
+    fetches = con.execute("SELECT unit_id, COUNT(*) FROM fetch_log GROUP BY unit_id").fetchall()
+    per_worker = con.execute("SELECT worker_id, COUNT(*) FROM fetch_log GROUP BY worker_id ORDER BY 1").fetchall()
+    con.close()
+    stats = queue.stats(run_id)
+    queue.close()
+
+    fetched = {u for u, _ in fetches}
+    dupes = [u for u, n in fetches if n > 1]
+    ok = fetched == {u.unit_id for u in units} and not dupes and stats.get("done") == len(units)
+
+    print(f"[sharding] simulate units={len(units)} workers={workers} elapsed={elapsed:.1f}s queue={stats}")
+    print(f"[sharding] fetches per worker: {dict(per_worker)}")
+    print(f"[sharding] duplicate fetches: {len(dupes)}  exit codes: {[p.exitcode for p in procs]}")
+    print(f"[sharding] {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+# ----------------------------- CLI -----------------------------
+def _open_queue(spec: str) -> WorkQueue:
+    if spec == "snowflake":
+        return WorkQueue.snowflake()
+    if spec.startswith("sqlite:"):
+        return WorkQueue.sqlite(spec[len("sqlite:"):])
+    raise SystemExit(f"--queue must be 'snowflake' or 'sqlite:<path>', got {spec!r}")
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Sharded ingestion: plan work units and run workers.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    for name in ("plan", "work"):
+        p = sub.add_parser(name)
+        p.add_argument("--queue", default="snowflake", help="'snowflake' or 'sqlite:<path>'")
+        p.add_argument("--run-id", default=date.today().isoformat())
+        p.add_argument("--chunk-days", type=int, default=DEFAULT_CHUNK_DAYS)
+    work = sub.choices["work"]
+    work.add_argument("--worker-id", default=None)
+    work.add_argument("--lease-secs", type=int, default=DEFAULT_LEASE_SECS)
+    work.add_argument("--shard", help="static shard 'i/N' (no queue)")
+
+    sim = sub.add_parser("simulate")
+    sim.add_argument("--workers", type=int, default=4)
+    sim.add_argument("--routes", type=int, default=6)
+    sim.add_argument("--no-crash", action="store_true")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "simulate":
+        return 0 if simulate(args.workers, args.routes, crash=not args.no_crash) else 1
+
+    from ingestion.main import check_shardable, get_routes, load_config, run_units
+    config = load_config()
+    check_shardable(config)
+    units = plan_work_units(get_routes(config), config.horizon_days, args.chunk_days)
+
+    if args.cmd == "work" and args.shard:
+        index, count = (int(x) for x in args.shard.split("/"))
+        run_units(assign_shard(units, index, count), config)
+        return 0
+
+    queue = _open_queue(args.queue)
+    try:
+        queue.ensure_table()
+        queue.enqueue(args.run_id, units)
+        if args.cmd == "plan":
+            print(f"[sharding] run_id={args.run_id} planned={len(units)} queue={queue.stats(args.run_id)}")
+            return 0
+        n = run_worker(queue, args.run_id, lambda u: run_units([u], config),
+                       worker_id=args.worker_id, lease_secs=args.lease_secs)
+        print(f"[sharding] worker done: loaded {n} rows; queue={queue.stats(args.run_id)}")
+        return 0
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
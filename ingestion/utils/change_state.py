@@ -0,0 +1,105 @@
+from __future__ import annotations
+import hashlib
+import sqlite3
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+# -------------------------------------------------------------------
+# Change-only (CDC) state: last written quote per key, in a local SQLite file
+# -------------------------------------------------------------------
+# Key: (origin, destination, departure_date, source). A row is emitted only when
+# its (price, stops, airline) fingerprint differs from the last written one, or
+# as a heartbeat once the last write is heartbeat_days old. Rows are written with
+# CARRY_DAYS = heartbeat_days and dbt carries each one forward that long at most
+# (core_daily_quotes) to rebuild the daily series.
+#
+# A key with state that is not observed in a run (the fare disappeared, or the
+# fetch failed and returned no price) gets a tombstone row: price NULL. dbt stops
+# the carry-forward there and the state is cleared, so the next quote is written.
+#
+# The state is a file on one machine, so change-only mode is single-node only:
+# sharded and queued runs refuse it (work units, and the nodes they land on,
+# change from day to day).
+
+Row = Tuple[str, str, date, datetime, float, Optional[int], Optional[str], str]
+
+
+def _fingerprint(price_aud: float, stops: Optional[int], airline: Optional[str]) -> str:
+    return hashlib.sha1(f"{float(price_aud):.2f}|{stops}|{airline}".encode()).hexdigest()[:16]
+
+
+class ChangeState:
+    def __init__(self, path: str, heartbeat_days: int = 7):
+        self.heartbeat_days = heartbeat_days
+        self._con = sqlite3.connect(path, timeout=30)
+        self._con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS last_quote (
+                origin TEXT, destination TEXT, departure_date TEXT, source TEXT,
+                fingerprint TEXT, written_day TEXT,
+                PRIMARY KEY (origin, destination, departure_date, source)
+            )
+            """
+        )
+        self._con.commit()
+
+    def filter_changed(self, batch: List[Row]) -> List[Row]:
+        """Rows whose quote changed since the last write, or whose heartbeat is due."""
+        out = []
+        for row in batch:
+            origin, destination, dep, observed_at, price, stops, airline, source = row
+            prev = self._con.execute(
+                "SELECT fingerprint, written_day FROM last_quote "
+                "WHERE origin = ? AND destination = ? AND departure_date = ? AND source = ?",
+                (origin, destination, dep.isoformat(), source),
+            ).fetchone()
+            if prev is None or prev[0] != _fingerprint(price, stops, airline):
+                out.append(row)
+                continue
+            due = date.fromisoformat(prev[1]) + timedelta(days=self.heartbeat_days)
+            if observed_at.date() >= due:
+                out.append(row)
+        return out
+
+    def tombstones(self, unobserved: List[Tuple[str, str, date, datetime, str]]) -> List[Row]:
+        """
+        Tombstone rows (price None) for (origin, destination, departure_date,
+        observed_at, source) keys that were not observed but still have state.
+        """
+        out = []
+        for origin, destination, dep, observed_at, source in unobserved:
+            prev = self._con.execute(
+                "SELECT 1 FROM last_quote "
+                "WHERE origin = ? AND destination = ? AND departure_date = ? AND source = ?",
+                (origin, destination, dep.isoformat(), source),
+            ).fetchone()
+            if prev is not None:
+                out.append((origin, destination, dep, observed_at, None, None, None, source))
+        return out
+
+    def mark_written(self, rows: List[Row]) -> None:
+        """Call only after the rows were committed to Snowflake (tombstones clear the key)."""
+        self._con.executemany(
+            "INSERT OR REPLACE INTO last_quote VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (origin, destination, dep.isoformat(), source,
+                 _fingerprint(price, stops, airline), observed_at.date().isoformat())
+                for origin, destination, dep, observed_at, price, stops, airline, source in rows
+                if price is not None
+            ],
+        )
+        self._con.executemany(
+            "DELETE FROM last_quote "
+            "WHERE origin = ? AND destination = ? AND departure_date = ? AND source = ?",
+            [
+                (origin, destination, dep.isoformat(), source)
+                for origin, destination, dep, observed_at, price, stops, airline, source in rows
+                if price is None
+            ],
+        )
+        # departures in the past will never be quoted again
+        self._con.execute("DELETE FROM last_quote WHERE departure_date < ?", (date.today().isoformat(),))
+        self._con.commit()
+
+    def close(self) -> None:
+        self._con.close()
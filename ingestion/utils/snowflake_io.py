@@ -1,10 +1,10 @@
 from __future__ import annotations
 import os
 from typing import List, Tuple, Optional
-import snowflake.connector
 from datetime import datetime
 import json
-from common.snow import connect_snowflake
+from common.snow import connect_snowflake, guarded_connect
+from common.query_metrics import execute as timed_execute
 
 # -------------------------------------------------------------------
 # Connection Helper
@@ -25,50 +25,88 @@ def _connect():
         kwargs["password"] = os.environ["SNOWFLAKE_PASSWORD"]
     else:
         raise RuntimeError("Provide SNOWFLAKE_PRIVATE_KEY_PATH or SNOWFLAKE_PASSWORD")
-    return snowflake.connector.connect(**kwargs)
+    return guarded_connect(**kwargs)
 
 # -------------------------------------------------------------------
 # Idempotent Insert (MERGE)
 # -------------------------------------------------------------------
 def insert_quotes(
-    batch: List[Tuple[str, str, datetime, datetime, float, Optional[int], Optional[str], str]]
+    batch: List[Tuple[str, str, datetime, datetime, float, Optional[int], Optional[str], str]],
+    carry_days: Optional[int] = None,
 ) -> int:
     """
     Insert or update parsed quotes into RAW.PRICE_QUOTES_PARSED (idempotent).
 
     Expected tuple order:
       (origin, destination, departure_date, observed_at, price_aud, stops, airline_code, source)
+
+    carry_days is stamped on every row: change-only ingestion sets it to its
+    heartbeat so dbt knows how long each quote stands for; None for full snapshots.
+    """
+    # staged + one MERGE: every statement is a single query id in the metrics
+    return merge_quotes_bulk(batch, carry_days=carry_days, tag="ingest.insert_quotes")
+
+# -------------------------------------------------------------------
+# Bulk idempotent load (temp table + single MERGE) for large replays
+# -------------------------------------------------------------------
+# executemany(INSERT ... VALUES) is sent as one multi-row INSERT; Snowflake caps
+# VALUES at 16,384 rows and a statement at 1 MB, so the stage is filled in chunks.
+STAGE_INSERT_ROWS = 5_000
+
+def merge_quotes_bulk(
+    batch: List[Tuple[str, str, datetime, datetime, float, Optional[int], Optional[str], str]],
+    con=None,
+    carry_days: Optional[int] = None,
+    tag: str = "backfill",
+) -> int:
+    """
+    Same contract as insert_quotes(), but stages the batch into a session temp
+    table with multi-row INSERTs of STAGE_INSERT_ROWS and applies a single
+    MERGE, instead of one MERGE per row. insert_quotes() and the backfill both load
+    through it; `tag` prefixes the query-metrics tags.
+
+    Pass an open connection to reuse it across chunks (the temp table lives for
+    the session); otherwise a connection is opened for this call.
     """
     if not batch:
         return 0
 
-    dict_rows = []
-    for origin, destination, dep_date, observed_at, price_aud, stops, airline, source in batch:
-        dict_rows.append(
-            {
-                "origin": origin,
-                "destination": destination,
-                "departure_date": dep_date,
-                "quote_ts": observed_at,  # matches QUOTE_TS
-                "price_aud": float(price_aud),
-                "stops": int(stops) if stops is not None else None,
-                "airline_code": airline,
-                "source": source,
-            }
+    rows = [
+        (
+            origin,
+            destination,
+            dep_date,
+            observed_at,
+            float(price_aud) if price_aud is not None else None,
+            int(stops) if stops is not None else None,
+            airline,
+            source,
+            carry_days,
         )
+        for origin, destination, dep_date, observed_at, price_aud, stops, airline, source in batch
+    ]
 
-    sql = """
+    create_sql = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS FLIGHT_DB.RAW.PRICE_QUOTES_PARSED_STAGE (
+        origin STRING, destination STRING, departure_date DATE, quote_ts TIMESTAMP_TZ,
+        price_aud NUMBER(10,2), stops INTEGER, airline_code STRING, source STRING,
+        carry_days INTEGER
+    )
+    """
+    insert_sql = """
+    INSERT INTO FLIGHT_DB.RAW.PRICE_QUOTES_PARSED_STAGE
+        (origin, destination, departure_date, quote_ts, price_aud, stops, airline_code, source, carry_days)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """
+    # QUALIFY keeps MERGE deterministic if a chunk carries the same key twice
+    merge_sql = """
     MERGE INTO FLIGHT_DB.RAW.PRICE_QUOTES_PARSED AS tgt
     USING (
-        SELECT
-            %(origin)s AS origin,
-            %(destination)s AS destination,
-            %(departure_date)s AS departure_date,
-            %(quote_ts)s AS quote_ts,
-            %(price_aud)s AS price_aud,
-            %(stops)s AS stops,
-            %(airline_code)s AS airline_code,
-            %(source)s AS source
+        SELECT * FROM FLIGHT_DB.RAW.PRICE_QUOTES_PARSED_STAGE
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY origin, destination, departure_date, quote_ts
+            ORDER BY price_aud
+        ) = 1
     ) AS src
     ON tgt.origin = src.origin
        AND tgt.destination = src.destination
@@ -79,21 +117,31 @@ def insert_quotes(
             tgt.price_aud = src.price_aud,
             tgt.stops = src.stops,
             tgt.airline_code = src.airline_code,
-            tgt.source = src.source
+            tgt.source = src.source,
+            tgt.carry_days = src.carry_days
     WHEN NOT MATCHED THEN
-        INSERT (origin, destination, departure_date, quote_ts, price_aud, stops, airline_code, source)
-        VALUES (src.origin, src.destination, src.departure_date, src.quote_ts, src.price_aud, src.stops, src.airline_code, src.source);
+        INSERT (origin, destination, departure_date, quote_ts, price_aud, stops, airline_code, source, carry_days)
+        VALUES (src.origin, src.destination, src.departure_date, src.quote_ts, src.price_aud, src.stops, src.airline_code, src.source, src.carry_days);
     """
 
-    with connect_snowflake() as con:
-        cur = con.cursor()
+    def _load(c) -> int:
+        cur = c.cursor()
         try:
-            cur.executemany(sql, dict_rows)
-            con.commit()
-            return len(batch)
+            timed_execute(cur, create_sql, tag=f"{tag}.stage_create")
+            timed_execute(cur, "TRUNCATE TABLE FLIGHT_DB.RAW.PRICE_QUOTES_PARSED_STAGE", tag=f"{tag}.stage_truncate")
+            for i in range(0, len(rows), STAGE_INSERT_ROWS):
+                timed_execute(cur, insert_sql, rows[i:i + STAGE_INSERT_ROWS], tag=f"{tag}.stage_insert", many=True)
+            timed_execute(cur, merge_sql, tag=f"{tag}.merge")
+            c.commit()
+            return len(rows)
         finally:
             cur.close()
 
+    if con is not None:
+        return _load(con)
+    with connect_snowflake() as c:
+        return _load(c)
+
 # -------------------------------------------------------------------
 # Raw JSON insert unchanged
 # -------------------------------------------------------------------
@@ -124,7 +172,8 @@ def insert_raw_json(
     with _connect() as con:
         cur = con.cursor()
         try:
-            cur.execute(
+            timed_execute(
+                cur,
                 sql,
                 {
                     "ingested_at": observed_at,
@@ -132,6 +181,7 @@ def insert_raw_json(
                     "params_str": params_str,
                     "raw_str": raw_str,
                 },
+                tag="ingest.insert_raw_json",
             )
             con.commit()
             return cur.rowcount or 0
@@ -6,10 +6,14 @@ import subprocess
 from pathlib import Path
 
 from prefect import flow, task, get_run_logger
-from snowflake.connector.errors import DatabaseError
+
+from common.circuit_breaker import CircuitOpenError
+from common.snow import is_auth_error
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Circuit breaker (prevents repeated bad logins from re-locking your user)
+# Persists across runs. Within a run, common.circuit_breaker sheds calls to a
+# failing Snowflake / Tequila for all concurrent tasks at once.
 # ──────────────────────────────────────────────────────────────────────────────
 CIRCUIT_FILE = Path(".sf_circuit_open")
 
@@ -24,6 +28,7 @@ def _close_circuit() -> None:
         CIRCUIT_FILE.unlink()
 
 
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Ingestion
 # ──────────────────────────────────────────────────────────────────────────────
@@ -31,7 +36,8 @@ def _close_circuit() -> None:
 @task(retries=2, retry_delay_seconds=[60, 180], name="run-ingestion")
 def ingest_task() -> int:
     """
-    Runs the ingestion once. Retries on transient failures.
+    Runs the ingestion once. Retries on transient failures; dates shed by an
+    open breaker are re-run inside run_once (SHED_RETRIES) without re-fetching the rest.
     IMPORTANT: If the underlying code raises a Snowflake auth/lock/MFA error,
     we DO NOT want infinite retries (handled by the flow's circuit breaker).
     """
@@ -41,6 +47,61 @@ def ingest_task() -> int:
     return int(inserted or 0)
 
 
+# ──────────────────────────────────────────────────────────────────────────────
+# Sharded ingestion (work queue in FLIGHT_DB.RAW.INGEST_WORK_QUEUE)
+# ──────────────────────────────────────────────────────────────────────────────
+@task(name="plan-shards")
+def plan_shards_task(run_id: str, chunk_days: int = 7) -> int:
+    """
+    Enqueue today's (route, departure-date range) units. Idempotent per run_id,
+    so every node may call it; only the first one actually inserts.
+    """
+    from ingestion.main import check_shardable, get_routes, load_config
+    from ingestion.sharding import WorkQueue, plan_work_units
+
+    config = load_config()
+    check_shardable(config)
+    units = plan_work_units(get_routes(config), config.horizon_days, chunk_days)
+    queue = WorkQueue.snowflake()
+    try:
+        queue.ensure_table()
+        queue.enqueue(run_id, units)
+    finally:
+        queue.close()
+    return len(units)
+
+
+@task(name="ingest-worker")
+def worker_task(run_id: str, worker_id: str) -> int:
+    """
+    Claim/fetch/ack units until the queue is drained (including units whose
+    lease expired on another worker). No task retries: a failed unit is released
+    back to the queue and retried by whichever worker claims it next.
+    """
+    from ingestion.main import check_shardable, load_config, run_units
+    from ingestion.sharding import WorkQueue, run_worker
+
+    config = load_config()
+    check_shardable(config)
+    queue = WorkQueue.snowflake()
+    try:
+        return run_worker(queue, run_id, lambda unit: run_units([unit], config), worker_id=worker_id)
+    finally:
+        queue.close()
+
+
+@task(name="queue-failed-units")
+def failed_units_task(run_id: str) -> list:
+    """unit_ids of the run that ran out of attempts (their departures were not loaded)."""
+    from ingestion.sharding import WorkQueue
+
+    queue = WorkQueue.snowflake()
+    try:
+        return queue.failed_units(run_id)
+    finally:
+        queue.close()
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # dbt transforms + tests
 # ──────────────────────────────────────────────────────────────────────────────
@@ -68,18 +129,54 @@ def dbt_task():
     )
 
 
+# ──────────────────────────────────────────────────────────────────────────────
+# Local Parquet lake export (cheap downstream reads)
+# ──────────────────────────────────────────────────────────────────────────────
+@task(retries=1, retry_delay_seconds=60, name="export-parquet-lake")
+def export_lake_task() -> int:
+    """
+    Rewrites the open quote months of the mart in the Hive-partitioned Parquet
+    dataset (LAKE_DIR). Incremental via a watermark; a retry never duplicates files.
+    """
+    from common.lake import export_mart
+
+    return export_mart()
+
+
+def _export_lake(log) -> None:
+    # The lake is a convenience copy: a failed export must not fail the pipeline.
+    try:
+        exported = export_lake_task()
+        log.info(f"[prefect] parquet lake export: {exported} rows")
+    except Exception as e:
+        log.warning(f"[prefect] parquet lake export failed (Snowflake data is fine): {e}")
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Orchestration flow
 # ──────────────────────────────────────────────────────────────────────────────
+def _pin_metrics_run_id() -> None:
+    # group every query of this flow run under its id in the query-metrics report
+    from prefect.runtime import flow_run
+    from common.query_metrics import set_run_id
+
+    if flow_run.id:
+        set_run_id(flow_run.id)
+
+
 @flow(name="flight-price-tracker-daily")
 def daily_flow():
     """
     Orchestrates the daily pipeline:
       1) Ingestion -> Snowflake RAW
       2) dbt run + dbt test (STG -> CORE -> MART)
+      3) Export new mart rows to the local Parquet lake
     Circuit breaker will skip runs after hard auth/lock errors until fixed.
     """
+    from snowflake.connector.errors import DatabaseError  # lazy: keeps flow import light
+
     log = get_run_logger()
+    _pin_metrics_run_id()
 
     # Safety first: if we recently saw an auth lock, skip to avoid re-locking.
     if _circuit_open():
@@ -91,15 +188,9 @@ def daily_flow():
         inserted = ingest_task()
         log.info(f"[prefect] ingestion inserted rows: {inserted}")
         _close_circuit()  # success closes the breaker if it was open
-    except DatabaseError as e:
-        msg = str(e).lower()
+    except (DatabaseError, CircuitOpenError) as e:
         # Fail-fast on authentication/lock/MFA signals and open the circuit.
-        if (
-            "incorrect username or password" in msg
-            or "temporarily locked" in msg
-            or "mfa" in msg
-            or "authentication" in msg
-        ):
+        if is_auth_error(e):
             log.error("Auth/lock error detected; opening circuit breaker for safety.")
             _open_circuit()
         # Re-raise so Prefect marks this run as failed (and respects task retries)
@@ -109,6 +200,76 @@ def daily_flow():
     dbt_task()
     log.info("[prefect] dbt run+test complete")
 
+    _export_lake(log)
+
+
+@flow(name="flight-price-tracker-sharded")
+def sharded_flow(workers: int = 4, run_id: str | None = None, chunk_days: int = 7):
+    """
+    Same pipeline as daily_flow, but ingestion is split into work units and run
+    by `workers` concurrent tasks here plus any worker_flow runs on other nodes.
+    dbt starts once the queue is drained. Units that ran out of attempts are
+    logged and fail the run after dbt and the lake export.
+    """
+    from datetime import date
+    from snowflake.connector.errors import DatabaseError
+    from ingestion.sharding import default_worker_id
+
+    log = get_run_logger()
+    _pin_metrics_run_id()
+    if _circuit_open():
+        log.warning("Circuit OPEN — skipping ingestion to avoid Snowflake lockouts.")
+        return
+
+    run_id = run_id or date.today().isoformat()
+    try:
+        planned = plan_shards_task(run_id, chunk_days)
+        log.info(f"[prefect] run_id={run_id} planned {planned} work units for {workers} local workers")
+        host = default_worker_id()
+        futures = [worker_task.submit(run_id, f"{host}-w{i}") for i in range(workers)]
+        inserted = sum(int(f.result() or 0) for f in futures)
+        log.info(f"[prefect] ingestion inserted rows: {inserted}")
+        _close_circuit()
+        failed = failed_units_task(run_id)
+    except (DatabaseError, CircuitOpenError) as e:
+        if is_auth_error(e):
+            log.error("Auth/lock error detected; opening circuit breaker for safety.")
+            _open_circuit()
+        raise
+
+    if failed:
+        log.error(f"[prefect] {len(failed)} work units ran out of attempts: {', '.join(failed[:20])}")
+
+    # dbt still runs, so everything that did load reaches the mart and the app
+    dbt_task()
+    log.info("[prefect] dbt run+test complete")
+
+    _export_lake(log)
+
+    if failed:
+        raise RuntimeError(f"run_id={run_id}: {len(failed)} work units were not loaded (see log)")
+
+
+@flow(name="flight-price-tracker-worker")
+def worker_flow(run_id: str | None = None, worker_id: str | None = None, chunk_days: int = 7):
+    """
+    Extra ingestion capacity on another node: joins the day's queue and drains it.
+    Does not run dbt (sharded_flow does, once all units are done).
+    """
+    from datetime import date
+    from ingestion.sharding import default_worker_id
+
+    log = get_run_logger()
+    _pin_metrics_run_id()
+    if _circuit_open():
+        log.warning("Circuit OPEN — skipping ingestion to avoid Snowflake lockouts.")
+        return
+
+    run_id = run_id or date.today().isoformat()
+    plan_shards_task(run_id, chunk_days)
+    inserted = worker_task(run_id, worker_id or default_worker_id())
+    log.info(f"[prefect] worker inserted rows: {inserted}")
+
 
 if __name__ == "__main__":
     # Ad-hoc local execution (no schedule)
@@ -32,8 +32,10 @@ CREATE OR REPLACE TABLE FLIGHT_DB.RAW.PRICE_QUOTES_PARSED (
   STOPS          INTEGER,         -- 0, 1, 2+
   AIRLINE_CODE   STRING,          -- optional (MVP)
   SOURCE         STRING,          -- 'skyscanner' etc.
-  CABIN          STRING           -- 'Y' (Economy)
+  CABIN          STRING,          -- 'Y' (Economy)
+  CARRY_DAYS     INTEGER          -- change-only rows: days the quote stands for (NULL = 1)
 );
+-- existing installs: ALTER TABLE FLIGHT_DB.RAW.PRICE_QUOTES_PARSED ADD COLUMN IF NOT EXISTS CARRY_DAYS INTEGER;
 
 CREATE OR REPLACE TABLE FLIGHT_DB.RAW.PRICE_QUOTES_JSON (
   INGESTED_AT TIMESTAMP_TZ,
@@ -0,0 +1,52 @@
+-- =========================================================
+-- Query cost report: which query templates burn WH_XS time?
+-- Complements `python -m common.query_metrics report --snowflake`
+-- (local per-run metrics) with the account-wide view.
+-- Run with:
+--   snowsql -c myconn -f sql/05_query_cost_report.sql
+-- Note: ACCOUNT_USAGE views lag by up to ~45 minutes.
+-- =========================================================
+
+-- 1) Top query templates (last 7 days) by total elapsed time
+SELECT '=== Top query templates on WH_XS (7 days) ===' AS step;
+SELECT
+  query_parameterized_hash                             AS template_hash,
+  ANY_VALUE(LEFT(REGEXP_REPLACE(query_text, '\\s+', ' '), 120)) AS sample_text,
+  COUNT(*)                                             AS calls,
+  ROUND(SUM(total_elapsed_time) / 1000, 1)             AS total_secs,
+  ROUND(MEDIAN(total_elapsed_time))                    AS p50_ms,
+  ROUND(SUM(bytes_scanned) / 1e6, 1)                   AS mb_scanned,
+  SUM(rows_produced)                                   AS rows_produced,
+  ROUND(AVG(percentage_scanned_from_cache) * 100, 1)   AS pct_scanned_from_cache
+FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+WHERE warehouse_name = 'WH_XS'
+  AND start_time >= DATEADD('day', -7, CURRENT_TIMESTAMP())
+GROUP BY 1
+ORDER BY total_secs DESC
+LIMIT 20;
+
+-- 2) Hourly credits next to the query load in the same hour
+SELECT '=== Credits vs query load per hour (7 days) ===' AS step;
+WITH q AS (
+  SELECT
+    DATE_TRUNC('hour', start_time)           AS usage_hour,
+    COUNT(*)                                 AS queries,
+    ROUND(SUM(total_elapsed_time) / 1000, 1) AS query_secs,
+    ROUND(SUM(bytes_scanned) / 1e6, 1)       AS mb_scanned
+  FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+  WHERE warehouse_name = 'WH_XS'
+    AND start_time >= DATEADD('day', -7, CURRENT_TIMESTAMP())
+  GROUP BY 1
+)
+SELECT
+  m.start_time      AS usage_hour,
+  m.credits_used,
+  q.queries,
+  q.query_secs,
+  q.mb_scanned
+FROM SNOWFLAKE.ACCOUNT_USAGE.WAREHOUSE_METERING_HISTORY m
+LEFT JOIN q
+  ON q.usage_hour = m.start_time
+WHERE m.warehouse_name = 'WH_XS'
+  AND m.start_time >= DATEADD('day', -7, CURRENT_TIMESTAMP())
+ORDER BY m.start_time DESC;